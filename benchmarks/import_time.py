@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Measure how long `import wyzesense` takes in a fresh interpreter.
+
+Each run starts a new interpreter with `-X importtime` and sums the
+self time of the modules imported by the statement under test, so the
+interpreter's own startup is excluded. Also fails if anything outside
+the standard library gets imported.
+
+Usage: python benchmarks/import_time.py [--runs N] [--statement STMT]
+"""
+import os
+import sys
+import argparse
+import sysconfig
+import compileall
+import importlib.util
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _ImportTimes(statement):
+    # Modules already loaded by a bare interpreter are not reported again
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                       env=env, capture_output=True, text=True, check=True)
+
+    times = {}
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def _IsStdlib(name):
+    if hasattr(sys, 'stdlib_module_names'):
+        return name in sys.stdlib_module_names
+
+    # Python 3.9: go by where the module would be loaded from
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.origin in (None, 'built-in', 'frozen'):
+        return spec is not None
+    origin = os.path.realpath(spec.origin)
+    paths = sysconfig.get_paths()
+    site = [os.path.realpath(paths[k]) for k in ('purelib', 'platlib')]
+    if any(origin.startswith(p + os.sep) for p in site):
+        return False
+    stdlib = [os.path.realpath(paths[k]) for k in ('stdlib', 'platstdlib')]
+    return any(origin.startswith(p + os.sep) for p in stdlib)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--statement', default="import wyzesense")
+    args = parser.parse_args()
+
+    # Measure with bytecode cached, as it is for an installed package
+    compileall.compile_dir(os.path.join(ROOT, "wyzesense"), quiet=1)
+
+    baseline = set(_ImportTimes("pass"))
+    totals = []
+    modules = {}
+    for _ in range(args.runs):
+        times = dict((k, v) for k, v in _ImportTimes(args.statement).items() if k not in baseline)
+        totals.append(sum(times.values()))
+        for name, us in times.items():
+            modules.setdefault(name, []).append(us)
+
+    print("%s: median %.2f ms, min %.2f ms over %d runs" % (
+        args.statement, statistics.median(totals) / 1000.0, min(totals) / 1000.0, args.runs))
+    print("Slowest modules (median self time):")
+    for name, us in sorted(modules.items(), key=lambda kv: -statistics.median(kv[1]))[:10]:
+        print("  %8.2f ms  %s" % (statistics.median(us) / 1000.0, name))
+
+    top_level = set(name.split(".")[0] for name in modules) - {"wyzesense"}
+    third_party = sorted(name for name in top_level if not _IsStdlib(name))
+    if third_party:
+        print("Non-stdlib modules imported: %s" % ", ".join(third_party))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,14 +16,9 @@
   sample.py --device /dev/hidraw0   # Using WyzeSense USB bridge /dev/hidraw0
 
 """
-from __future__ import print_function
-
-from builtins import input
-
 import re
 import sys
 import logging
-import binascii
 import wyzesense
 
 
@@ -52,7 +47,7 @@ def main(args):
         print("Gateway info:")
         print("\tMAC:%s" % ws.MAC)
         print("\tVER:%s" % ws.Version)
-        print("\tENR:%s" % binascii.hexlify(ws.ENR))
+        print("\tENR:%s" % ws.ENR.hex())
     except IOError:
         print("No device found on path %r" % device)
         return 2
@@ -0,0 +1,134 @@
+"""A simulated dongle on a pseudo terminal, for tests and benchmarks.
+
+Open the Dongle on `FakeDongle.path`. Every command is answered after
+`delay` seconds on a thread of its own, so commands in flight at the
+same time are answered concurrently like a real dongle does.
+"""
+import os
+import pty
+import tty
+import time
+import struct
+import threading
+
+from wyzesense.gateway import Packet, checksum_from_bytes
+
+
+def Frame(cmd, payload=b""):
+    pkt = struct.pack(">HBBB", 0x55AA, cmd >> 8, len(payload) + 3, cmd & 0xFF) + payload
+    return pkt + struct.pack(">H", checksum_from_bytes(pkt))
+
+
+class FakeDongle(object):
+    def __init__(self, sensors=("AAAA0001", "AAAA0002"), delay=0.0):
+        self.__master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.__slave = slave
+        self.__lock = threading.Lock()
+        self.path = os.ttyname(slave)
+        self.sensors = list(sensors)
+        self.delay = delay
+        # Sensor count to report, if not len(sensors)
+        self.count = None
+        # Extra delay before the first sensor list report
+        self.list_delay = 0.0
+        # Sensor list reports are held back while this is clear
+        self.list_gate = threading.Event()
+        self.list_gate.set()
+        # (mac, type, version) of sensors to announce, one per scan
+        self.pairing = []
+        # cmd -> number of requests left to ignore
+        self.drop = {}
+        # (monotonic time, cmd) for every request received
+        self.received = []
+        threading.Thread(target=self._Run, daemon=True).start()
+
+    def Close(self):
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    def Count(self, cmd):
+        return sum(1 for _, c in self.received if c == cmd)
+
+    def Send(self, data):
+        with self.__lock:
+            while data:
+                chunk, data = data[:0x3F], data[0x3F:]
+                report = bytes([len(chunk)]) + chunk
+                try:
+                    os.write(self.__master, report + b"\x00" * (0x40 - len(report)))
+                except OSError:
+                    # Closed while a delayed reply was pending
+                    return
+
+    def Alarm(self, mac, timestamp_ms, state=1):
+        payload = struct.pack(">QB8s", timestamp_ms, 0xA2, mac.encode('ascii'))
+        self.Send(Frame(Packet.NOTIFY_SENSOR_ALARM, payload + bytes([1, 0, 90, 0, 0, state, 0, 0, 70])))
+
+    def _Reply(self, cmd, payload=b""):
+        self.Send(Frame(cmd + 1, payload))
+
+    def _Handle(self, cmd, payload):
+        if self.drop.get(cmd):
+            self.drop[cmd] -= 1
+            return
+
+        time.sleep(self.delay)
+        if cmd == Packet.CMD_INQUIRY:
+            self._Reply(cmd, b"\x01")
+        elif cmd == Packet.CMD_GET_ENR:
+            self._Reply(cmd, b"E" * 16)
+        elif cmd == Packet.CMD_GET_MAC:
+            self._Reply(cmd, b"DONGLE01")
+        elif cmd == Packet.CMD_GET_DONGLE_VERSION:
+            self._Reply(cmd, b"0.0.0.30")
+        elif cmd == Packet.CMD_FINISH_AUTH:
+            self._Reply(cmd)
+        elif cmd == Packet.CMD_GET_SENSOR_COUNT:
+            self._Reply(cmd, bytes([len(self.sensors) if self.count is None else self.count]))
+        elif cmd == Packet.CMD_GET_SENSOR_LIST:
+            self.list_gate.wait()
+            time.sleep(self.list_delay)
+            for mac in list(self.sensors):
+                self._Reply(cmd, mac.encode('ascii'))
+        elif cmd == Packet.CMD_START_STOP_SCAN:
+            self._Reply(cmd, b"\x01")
+            if payload == b"\x01" and self.pairing:
+                mac, sensor_type, version = self.pairing.pop(0)
+                self.Send(Frame(Packet.NOTIFY_SENSOR_SCAN,
+                                b"\x00" + mac.encode('ascii') + bytes([sensor_type, version])))
+        elif cmd == Packet.CMD_GET_SENSOR_R1:
+            self._Reply(cmd, b"R" * 16)
+        elif cmd == Packet.CMD_VERIFY_SENSOR:
+            self.sensors.append(payload[:8].decode('ascii'))
+            self._Reply(cmd)
+        elif cmd == Packet.CMD_DEL_SENSOR:
+            mac = payload[:8].decode('ascii')
+            if mac in self.sensors:
+                self.sensors.remove(mac)
+            self._Reply(cmd, payload[:8] + b"\xFF")
+
+    def _Run(self):
+        s = b""
+        while True:
+            try:
+                s += os.read(self.__master, 1024)
+            except OSError:
+                return
+
+            while True:
+                start = s.find(b"\xAA\x55")
+                if start == -1 or len(s) < start + 7:
+                    break
+                s = s[start:]
+                cmd = (s[2] << 8) | s[4]
+                if cmd == Packet.ASYNC_ACK:
+                    s = s[7:]
+                    continue
+
+                length = s[3] + 4
+                if len(s) < length:
+                    break
+                payload, s = s[5:length - 2], s[length:]
+                self.received.append((time.monotonic(), cmd))
+                threading.Thread(target=self._Handle, args=(cmd, payload), daemon=True).start()
@@ -0,0 +1,120 @@
+import os
+import io
+import json
+import random
+import struct
+import shutil
+import tempfile
+import unittest
+
+from wyzesense import capture
+from wyzesense.gateway import Packet, SensorEvent, checksum_from_bytes
+
+
+def frame(cmd, payload=b""):
+    pkt = struct.pack(">HBBB", 0x55AA, cmd >> 8, len(payload) + 3, cmd & 0xFF) + payload
+    return pkt + struct.pack(">H", checksum_from_bytes(pkt))
+
+
+def alarm(i, event_type=0xA2, data=None):
+    if data is None:
+        data = bytes([1, 0, 90, 0, 0, i % 2, 0, 0, 70])
+    return frame(Packet.NOTIFY_SENSOR_ALARM, struct.pack(">QB8s", 1700000000000 + i, event_type, b"7779%04X" % i) + data)
+
+
+def event_log(i):
+    return frame(Packet.NOTIFY_EVENT_LOG, struct.pack(">QB", 1700000000000 + i, 4) + b"\x07\x55\xAA")
+
+
+class SensorEventParseTest(unittest.TestCase):
+    def parse(self, data, event_type=0xA2):
+        return SensorEvent.Parse(alarm(1, event_type, data)[5:-2])
+
+    def test_state(self):
+        e = self.parse(bytes([2, 0, 90, 0, 0, 1, 0, 0, 70]))
+        self.assertEqual(e.Type, "state")
+        self.assertEqual(e.Data, ("motion", "active", 90, 70))
+        self.assertEqual(e.MAC, "77790001")
+
+    def test_unknown_e8_layout_is_raw(self):
+        e = self.parse(bytes([1, 0, 90, 0, 0, 1, 0, 0, 70]), 0xE8)
+        self.assertEqual(e.Type, "raw_E8")
+
+    def test_short_state_is_raw(self):
+        e = self.parse(bytes([1, 0, 90]))
+        self.assertEqual(e.Type, "raw_A2")
+        self.assertEqual(e.Data, bytes([1, 0, 90]))
+
+    def test_too_short(self):
+        self.assertIsNone(SensorEvent.Parse(b"\x00" * 17))
+
+
+class DecodeFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        rng = random.Random(1)
+        data = bytearray()
+        for i in range(300):
+            if rng.random() < 0.2:
+                # Garbage that looks like a frame start, to force resyncs
+                data += b"\x55\xAA\x00" + bytes(rng.randrange(256) for _ in range(5))
+            data += alarm(i) if i % 3 else event_log(i)
+        data += alarm(300, 0xE8) + alarm(301, 0xA2, b"\x01")
+        self.path = os.path.join(self.dir, "capture.bin")
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self.size = len(data)
+
+    def decode(self, **kwargs):
+        return list(capture.DecodeFiles([self.path], **kwargs))
+
+    def test_single_chunk(self):
+        records = self.decode(workers=1, chunk_size=self.size)
+        self.assertEqual(len(records), 302)
+        self.assertEqual(records[1]['type'], 'state')
+        self.assertEqual(records[0]['type'], 'log')
+        self.assertEqual(records[0]['data'], {'log_type': 7, 'data': '55aa'})
+        self.assertEqual(records[0]['raw_time'], 1700000000.0)
+        for record in records:
+            self.assertEqual(sorted(record), sorted(capture.COLUMNS))
+        self.assertEqual(records[-2]['type'], 'raw_E8')
+        self.assertEqual(records[-1]['type'], 'raw_A2')
+
+    def test_chunk_boundaries(self):
+        expected = self.decode(workers=1, chunk_size=self.size)
+        # Chunks smaller than a frame put boundaries everywhere
+        for chunk_size in (7, 19, 64, 1000):
+            self.assertEqual(self.decode(workers=1, chunk_size=chunk_size), expected, chunk_size)
+
+    def test_process_pool(self):
+        expected = self.decode(workers=1, chunk_size=self.size)
+        self.assertEqual(self.decode(workers=2, chunk_size=500), expected)
+
+    def test_same_file_twice(self):
+        records = list(capture.DecodeFiles([self.path, self.path], workers=1, chunk_size=333))
+        self.assertEqual(len(records), 2 * 302)
+
+    def test_writers(self):
+        records = self.decode(workers=1, chunk_size=self.size)[:3]
+        out = io.StringIO()
+        self.assertEqual(capture.WriteLines((capture.EncodeJson(r) for r in records), out), 3)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()], records)
+
+        out = io.StringIO()
+        capture.WriteColumns(iter(records), out)
+        columns = json.loads(out.getvalue())
+        self.assertEqual(columns['count'], 3)
+        for name in records[0]:
+            self.assertEqual(columns['columns'][name], [r[name] for r in records])
+
+    def test_matches_live_events(self):
+        record = self.decode(workers=1, chunk_size=self.size)[1]
+        e = SensorEvent.Parse(alarm(1)[5:-2])
+        live = e.AsDict()
+        self.assertEqual(dict((k, record[k]) for k in live), json.loads(json.dumps(live)))
+
+
+if __name__ == '__main__':
+    unittest.main()
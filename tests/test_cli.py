@@ -0,0 +1,118 @@
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import contextlib
+import unittest
+
+from wyzesense.__main__ import main
+
+from fakedongle import FakeDongle
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeDongle(["AAAA0001", "AAAA0002"])
+        self.addCleanup(self.fake.Close)
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def run_main(self, *argv):
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            code = main(["--device", self.fake.path] + list(argv))
+        self.stderr = err.getvalue()
+        return code, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def script(self, text):
+        path = os.path.join(self.dir, "script")
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_list(self):
+        code, lines = self.run_main("list", "--format", "jsonl")
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, [{'command': 'list', 'sensors': ["AAAA0001", "AAAA0002"]}])
+
+    def test_info(self):
+        code, lines = self.run_main("info", "--format", "jsonl")
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, [{'command': 'info', 'mac': "DONGLE01", 'version': "0.0.0.30", 'enr': "45" * 16}])
+
+    def test_pair(self):
+        self.fake.pairing = [("NEWSENS1", 1, 2)]
+        code, lines = self.run_main("pair", "--format", "jsonl", "--count", "2", "--timeout", "0.2")
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, [{'command': 'pair', 'sensors': [{'mac': "NEWSENS1", 'type': 1, 'version': 2}]}])
+        self.assertIn("NEWSENS1", self.fake.sensors)
+
+    def test_unpair(self):
+        start = time.monotonic()
+        code, lines = self.run_main("unpair", "--format", "jsonl", "AAAA0001")
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, [{'command': 'unpair', 'removed': ["AAAA0001"]}])
+        self.assertEqual(self.fake.sensors, ["AAAA0002"])
+
+    def test_unpair_invalid_mac(self):
+        code, lines = self.run_main("unpair", "--format", "jsonl", "AAAA0001", "SHORT")
+        self.assertEqual(code, 1)
+        self.assertEqual(lines[0]['command'], 'unpair')
+        self.assertIn("SHORT", lines[0]['error'])
+        self.assertEqual(self.fake.sensors, ["AAAA0001", "AAAA0002"])
+
+    def test_unpair_invalid_mac_text(self):
+        code, lines = self.run_main("unpair", "SHORT")
+        self.assertEqual(code, 1)
+        self.assertIn("unpair: Invalid mac address", self.stderr)
+
+    def test_monitor(self):
+        timer = threading.Timer(0.3, self.fake.Alarm, ("AAAA0002", int(time.time() * 1000)))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        code, lines = self.run_main("monitor", "--format", "jsonl", "--count", "1", "--duration", "5")
+        self.assertEqual(code, 0)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['mac'], "AAAA0002")
+        self.assertEqual(lines[0]['type'], "state")
+        self.assertEqual(lines[0]['data']['state'], "open")
+
+    def test_no_device(self):
+        code = main(["--device", os.path.join(self.dir, "missing"), "list"])
+        self.assertEqual(code, 2)
+
+    def test_batch(self):
+        code, lines = self.run_main("batch", "--format", "jsonl", self.script("info\n# comment\n\nlist\n"))
+        self.assertEqual(code, 0)
+        self.assertEqual([line['command'] for line in lines], ['info', 'list'])
+
+    def test_batch_bad_line(self):
+        script = self.script("list\nbogus --flag\nunpair AAAA0001\n")
+        code, lines = self.run_main("batch", "--format", "jsonl", script)
+        self.assertEqual(code, 1)
+        self.assertEqual([line['command'] for line in lines], ['list', 'bogus', 'batch'])
+        self.assertIn('error', lines[1])
+        self.assertEqual(lines[2]['error'], "batch failed")
+        self.assertEqual(self.fake.sensors, ["AAAA0001", "AAAA0002"])
+
+    def test_batch_keep_going(self):
+        script = self.script("list\nbogus --flag\nunpair AAAA0001\n")
+        code, lines = self.run_main("batch", "--format", "jsonl", "--keep-going", script)
+        self.assertEqual(code, 1)
+        self.assertEqual([line['command'] for line in lines], ['list', 'bogus', 'unpair', 'batch'])
+        self.assertEqual(lines[2]['removed'], ["AAAA0001"])
+        self.assertEqual(self.fake.sensors, ["AAAA0002"])
+
+    def test_batch_line_format(self):
+        # A line's own --format overrides the batch default
+        code, lines = self.run_main("batch", "--format", "jsonl", self.script("list --format jsonl\n"))
+        self.assertEqual(code, 0)
+        self.assertEqual(lines, [{'command': 'list', 'sensors': ["AAAA0001", "AAAA0002"]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from wyzesense.clock import DongleClock, MergeEvents
+
+
+class Event(object):
+    def __init__(self, name, corrected_time):
+        self.Name = name
+        self.CorrectedTime = corrected_time
+
+
+class DongleClockTest(unittest.TestCase):
+    START = 1700000000.0
+
+    def simulate(self, clock, drift, offset, duration, rng):
+        """Feed packets stamped every ~20 s by a dongle whose clock runs
+        drift fast and offset behind, and return (dongle, host, corrected)."""
+        results = []
+        t = 0.0
+        while t < duration:
+            t += rng.uniform(10, 30)
+            true_time = self.START + t
+            dongle_time = self.START - offset + t / (1 + drift)
+            latency = rng.uniform(0.005, 0.05)
+            if rng.random() < 0.1:
+                # Deliveries delayed by a busy host
+                latency += rng.uniform(1, 30)
+            host_time = true_time + latency
+            results.append((dongle_time, host_time, clock.Correct(dongle_time, host_time)))
+        return results
+
+    def test_initial(self):
+        clock = DongleClock()
+        self.assertIsNone(clock.Offset())
+        self.assertEqual(clock.Drift, 0.0)
+
+    def test_offset(self):
+        clock = DongleClock()
+        self.simulate(clock, 0.0, 5.0, 300, random.Random(1))
+        self.assertAlmostEqual(clock.Offset(), 5.0, delta=0.02)
+        self.assertEqual(clock.Drift, 0.0)
+
+    def test_drift(self):
+        rng = random.Random(2)
+        for drift in (-100e-6, 0.0, 40e-6, 200e-6):
+            clock = DongleClock()
+            results = self.simulate(clock, drift, 3.0, 6 * 3600, rng)
+            self.assertAlmostEqual(clock.Drift, drift, delta=10e-6)
+
+            # Late in the run, corrections land within latency of the true time
+            for dongle_time, host_time, corrected in results[-100:]:
+                true_time = self.START + (dongle_time - self.START + 3.0) * (1 + drift)
+                self.assertAlmostEqual(corrected, true_time, delta=0.05)
+
+    def test_drift_clamped(self):
+        clock = DongleClock()
+        self.simulate(clock, 0.01, 0.0, 3600, random.Random(3))
+        self.assertEqual(clock.Drift, DongleClock._MAX_DRIFT)
+
+    def test_monotonic_and_not_in_future(self):
+        clock = DongleClock()
+        results = self.simulate(clock, 300e-6, 1.0, 3600, random.Random(4))
+        corrected = [c for _, _, c in results]
+        self.assertEqual(corrected, sorted(corrected))
+        for _, host_time, c in results:
+            self.assertLessEqual(c, host_time)
+
+        # A stamp from before the last one does not move time backwards
+        dongle_time, host_time, c = results[-1]
+        self.assertEqual(clock.Correct(dongle_time - 100, host_time + 1), c)
+
+    def test_sync_resets_offset(self):
+        clock = DongleClock()
+        self.simulate(clock, 100e-6, 7.0, 2 * 3600, random.Random(5))
+        drift = clock.Drift
+
+        host_time = self.START + 3 * 3600
+        clock.OnSync(host_time)
+        self.assertEqual(clock.Syncs, 1)
+        self.assertEqual(clock.Offset(), 0.0)
+        # Drift belongs to the oscillator and survives the sync
+        self.assertEqual(clock.Drift, drift)
+        self.assertAlmostEqual(clock.Offset(host_time + 1000), drift * 1000)
+
+
+class MergeEventsTest(unittest.TestCase):
+    def test_merge(self):
+        a = [Event("a%d" % i, t) for i, t in enumerate((1.0, 4.0, 5.0))]
+        b = [Event("b%d" % i, t) for i, t in enumerate((2.0, 3.0, 6.0))]
+        merged = [e.Name for e in MergeEvents(iter(a), iter(b), iter([]))]
+        self.assertEqual(merged, ["a0", "b0", "b1", "a1", "a2", "b2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
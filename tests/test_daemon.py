@@ -0,0 +1,228 @@
+import os
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from wyzesense import daemon, gateway
+
+from fakedongle import FakeDongle
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "wyzesense.sock")
+
+        self.fake = FakeDongle(["AAAA0001", "AAAA0002"])
+        self.addCleanup(self.fake.Close)
+        self.server = daemon.Server(self.path)
+        self.ws = gateway.Open(self.fake.path, self.server.OnEvent, prewarm=False)
+        self.addCleanup(self.ws.Stop)
+
+        thread = threading.Thread(target=self.server.Serve, args=(self.ws,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.Stop)
+        self.assertTrue(wait_for(self.listening))
+
+    def listening(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            return False
+        finally:
+            probe.close()
+        return True
+
+    def connect(self):
+        client = daemon.Client(self.path)
+        self.addCleanup(client.Close)
+        return client
+
+    def alarm(self, mac):
+        self.fake.Alarm(mac, int(time.time() * 1000))
+
+    def test_requests(self):
+        client = self.connect()
+        self.assertEqual(client.List(), ["AAAA0001", "AAAA0002"])
+        self.assertEqual(client.Info(), {'mac': "DONGLE01", 'version': "0.0.0.30", 'enr': "45" * 16})
+        client.Delete("AAAA0001")
+        self.assertEqual(client.List(), ["AAAA0002"])
+        self.assertIsNone(client.Scan(0.1))
+
+    def test_error(self):
+        client = self.connect()
+        with self.assertRaises(daemon.DaemonError) as cm:
+            client.Call('bogus')
+        self.assertIn("Unknown operation: bogus", str(cm.exception))
+        self.assertEqual(client.List(), ["AAAA0001", "AAAA0002"])
+
+    def test_multiplexing(self):
+        client = self.connect()
+        results = []
+
+        def call():
+            results.append((client.List(), client.Info()['mac']))
+
+        threads = [threading.Thread(target=call) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [(["AAAA0001", "AAAA0002"], "DONGLE01")] * 16)
+
+    def test_scans_do_not_starve_short_requests(self):
+        client = self.connect()
+        scans = [threading.Thread(target=client.Scan, args=(0.3,)) for _ in range(10)]
+        for t in scans:
+            t.start()
+        self.addCleanup(lambda: [t.join() for t in scans])
+        time.sleep(0.1)
+
+        start = time.monotonic()
+        self.assertEqual(client.List(), ["AAAA0001", "AAAA0002"])
+        self.assertEqual(client.EventLog(), [])
+        self.assertLess(time.monotonic() - start, 0.2)
+
+    def test_subscribe_filters(self):
+        client = self.connect()
+        got = dict((name, []) for name in ('all', 'mac', 'macs', 'type', 'other'))
+        client.Subscribe(lambda e: got['all'].append(e['mac']))
+        client.Subscribe(lambda e: got['mac'].append(e['mac']), mac="AAAA0001")
+        client.Subscribe(lambda e: got['macs'].append(e['mac']), mac=["AAAA0001", "AAAA0002"])
+        client.Subscribe(lambda e: got['type'].append(e['mac']), type="state")
+        client.Subscribe(lambda e: got['other'].append(e['mac']), type=["log"])
+
+        self.alarm("AAAA0001")
+        self.alarm("AAAA0002")
+        self.assertTrue(wait_for(lambda: len(got['all']) == 2 and len(got['type']) == 2))
+        self.assertEqual(got['mac'], ["AAAA0001"])
+        self.assertEqual(got['macs'], ["AAAA0001", "AAAA0002"])
+        self.assertEqual(got['other'], [])
+
+    def test_unsubscribe(self):
+        client = self.connect()
+        got = []
+        sid = client.Subscribe(got.append)
+        self.alarm("AAAA0001")
+        self.assertTrue(wait_for(lambda: got))
+
+        self.assertTrue(client.Unsubscribe(sid))
+        self.assertFalse(client.Unsubscribe(sid))
+        self.alarm("AAAA0001")
+        # Anything still in flight arrives before the reply to this
+        client.List()
+        self.assertEqual(len(got), 1)
+
+    def test_failing_callback(self):
+        client = self.connect()
+        got = []
+
+        def fail(e):
+            raise ValueError("broken callback")
+
+        client.Subscribe(fail)
+        client.Subscribe(got.append)
+        with self.assertLogs("wyzesense.daemon", "ERROR"):
+            self.alarm("AAAA0001")
+            self.assertTrue(wait_for(lambda: got))
+        self.assertFalse(client.Closed)
+        self.assertEqual(client.List(), ["AAAA0001", "AAAA0002"])
+
+    def test_failing_on_reply(self):
+        client = self.connect()
+
+        def fail(result):
+            raise ValueError("broken on_reply")
+
+        with self.assertLogs("wyzesense.daemon", "ERROR"):
+            self.assertEqual(client.Call('list', on_reply=fail), ["AAAA0001", "AAAA0002"])
+        self.assertEqual(client.List(), ["AAAA0001", "AAAA0002"])
+
+    def test_client_disconnect(self):
+        first, second = self.connect(), self.connect()
+        got = []
+        first.Subscribe(lambda e: None)
+        second.Subscribe(got.append)
+        connections = lambda: len(self.server._Server__connections)
+        self.assertTrue(wait_for(lambda: connections() == 2))
+
+        first.Close()
+        self.assertTrue(first.Closed)
+        self.assertRaises(daemon.DaemonError, first.List)
+        self.assertTrue(wait_for(lambda: connections() == 1))
+
+        self.alarm("AAAA0001")
+        self.assertTrue(wait_for(lambda: got))
+        self.assertEqual(second.List(), ["AAAA0001", "AAAA0002"])
+
+    def test_server_stop(self):
+        client = self.connect()
+        scan = []
+        t = threading.Thread(target=lambda: scan.append(self.assertRaises(daemon.DaemonError, client.Scan, 5)))
+        t.start()
+        time.sleep(0.1)
+        self.server.Stop()
+        t.join(2)
+        self.assertFalse(t.is_alive())
+        self.assertTrue(wait_for(lambda: client.Closed))
+        self.assertFalse(os.path.exists(self.path))
+        # Stopping twice, or concurrently, is harmless
+        self.server.Stop()
+
+    def test_connect_pool(self):
+        client = daemon.Connect(self.path)
+        self.assertIs(daemon.Connect(self.path), client)
+
+        client.Close()
+        self.assertFalse(client.Closed)
+        self.assertEqual(client.List(), ["AAAA0001", "AAAA0002"])
+
+        client.Close()
+        self.assertTrue(wait_for(lambda: client.Closed))
+        other = daemon.Connect(self.path)
+        self.addCleanup(other.Close)
+        self.assertIsNot(other, client)
+        self.assertEqual(other.List(), ["AAAA0001", "AAAA0002"])
+
+
+class BindTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "wyzesense.sock")
+
+    def test_stale_socket(self):
+        # Left behind by a daemon that died without cleaning up
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+
+        sock = daemon.Server(self.path)._Bind()
+        self.addCleanup(sock.close)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        probe.connect(self.path)
+        probe.close()
+
+    def test_socket_in_use(self):
+        sock = daemon.Server(self.path)._Bind()
+        self.addCleanup(sock.close)
+        with self.assertRaises(daemon.DaemonError):
+            daemon.Server(self.path)._Bind()
+        self.assertTrue(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import struct
+import unittest
+
+from wyzesense.eventlog import EventLogRecord, EventLogRing
+
+
+def make_payload(ts, msg):
+    return struct.pack(">QB", ts, len(msg) + 1) + msg
+
+
+class EventLogRecordTest(unittest.TestCase):
+    def test_parse(self):
+        r = EventLogRecord.Parse(make_payload(1234, b"\x07\x01\x02"))
+        self.assertEqual(r.Timestamp, 1234)
+        self.assertEqual(r.Type, 0x07)
+        self.assertEqual(r.Data, b"\x01\x02")
+        self.assertFalse(r.Truncated)
+
+    def test_parse_length_mismatch(self):
+        r = EventLogRecord.Parse(struct.pack(">QB", 5, 9) + b"abc")
+        self.assertTrue(r.Truncated)
+        self.assertEqual(r.Type, ord("a"))
+        self.assertEqual(r.Data, b"bc")
+
+    def test_parse_trailing_bytes(self):
+        r = EventLogRecord.Parse(make_payload(1234, b"\x07\x01\x02") + b"\xEE\xEE")
+        self.assertEqual(r.Type, 0x07)
+        self.assertEqual(r.Data, b"\x01\x02")
+        self.assertFalse(r.Truncated)
+
+    def test_parse_empty_message(self):
+        r = EventLogRecord.Parse(struct.pack(">QB", 5, 1))
+        self.assertIsNone(r.Type)
+        self.assertEqual(r.Data, b"")
+
+    def test_parse_short(self):
+        self.assertIsNone(EventLogRecord.Parse(b"\x00" * 8))
+
+
+class EventLogRingTest(unittest.TestCase):
+    def fill(self, ring, count):
+        for i in range(count):
+            ring.Append(EventLogRecord(1000 + i, i % 2, b""))
+
+    def test_partial(self):
+        ring = EventLogRing(4)
+        self.fill(ring, 3)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.Dropped, 0)
+        self.assertEqual([r.Timestamp for r in ring.Query()], [1000, 1001, 1002])
+
+    def test_wraparound(self):
+        ring = EventLogRing(3)
+        self.fill(ring, 7)
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.Capacity, 3)
+        self.assertEqual(ring.Dropped, 4)
+        self.assertEqual([r.Timestamp for r in ring.Query()], [1004, 1005, 1006])
+
+    def test_query_filters(self):
+        ring = EventLogRing(8)
+        self.fill(ring, 6)
+        self.assertEqual([r.Timestamp for r in ring.Query(start=1002, end=1005)], [1002, 1003, 1004])
+        self.assertEqual([r.Timestamp for r in ring.Query(log_type=1)], [1001, 1003, 1005])
+        self.assertEqual([r.Timestamp for r in ring.Query(log_type=[0, 1], start=1004)], [1004, 1005])
+
+    def test_limit(self):
+        ring = EventLogRing(3)
+        self.fill(ring, 5)
+        self.assertEqual([r.Timestamp for r in ring.Query(limit=2)], [1003, 1004])
+        self.assertEqual([r.Timestamp for r in ring.Query(log_type=0, limit=1)], [1004])
+        self.assertEqual(ring.Query(limit=0), [])
+        self.assertEqual([r.Timestamp for r in ring.Latest()], [1004])
+
+    def test_clear(self):
+        ring = EventLogRing(2)
+        self.fill(ring, 3)
+        ring.Clear()
+        self.assertEqual(len(ring), 0)
+        self.assertEqual(ring.Query(), [])
+        self.fill(ring, 1)
+        self.assertEqual([r.Timestamp for r in ring.Query()], [1000])
+
+
+if __name__ == '__main__':
+    unittest.main()
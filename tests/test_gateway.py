@@ -0,0 +1,205 @@
+import time
+import threading
+import unittest
+
+from wyzesense import gateway
+from wyzesense.gateway import Packet
+
+from fakedongle import FakeDongle
+
+
+class DongleTest(unittest.TestCase):
+    def open(self, delay=0.0, **kwargs):
+        self.fake = FakeDongle(["AAAA%04d" % i for i in range(5)], delay)
+        self.addCleanup(self.fake.Close)
+        self.events = []
+        self.on_event = self.events.append
+        ws = gateway.Open(self.fake.path, lambda ws, e: self.on_event(e), **kwargs)
+        self.addCleanup(ws.Stop)
+        return ws
+
+    def test_handshake_runs_queries_concurrently(self):
+        delay = 0.05
+        ws = self.open(delay, prewarm=False)
+        self.assertEqual((ws.MAC, ws.Version, ws.ENR), ("DONGLE01", "0.0.0.30", b"E" * 16))
+
+        sent = dict((cmd, t) for t, cmd in self.fake.received)
+        queries = [sent[Packet.CMD_GET_ENR], sent[Packet.CMD_GET_MAC], sent[Packet.CMD_GET_DONGLE_VERSION]]
+        # All three were sent before the first of them could be answered
+        self.assertLess(max(queries) - min(queries), delay)
+        self.assertGreater(sent[Packet.CMD_FINISH_AUTH] - max(queries), delay)
+
+    def test_deferred_queries(self):
+        ws = self.open(defer_queries=True, prewarm=False)
+        self.assertEqual(self.fake.Count(Packet.CMD_GET_ENR), 0)
+        self.assertEqual(ws.Version, "0.0.0.30")
+        self.assertEqual(ws.Version, "0.0.0.30")
+        self.assertEqual(self.fake.Count(Packet.CMD_GET_DONGLE_VERSION), 1)
+
+    def test_deferred_query_from_event_handler(self):
+        ws = self.open(defer_queries=True, prewarm=False)
+        result = []
+        done = threading.Event()
+
+        def on_event(e):
+            try:
+                ws.ENR
+            except RuntimeError as error:
+                result.append(error)
+            done.set()
+
+        self.on_event = on_event
+        self.fake.Alarm("AAAA0001", int(time.time() * 1000))
+        self.assertTrue(done.wait(2))
+        self.assertIsInstance(result[0], RuntimeError)
+        self.assertEqual(ws.ENR, b"E" * 16)
+
+    def test_list_cached(self):
+        ws = self.open(prewarm=False)
+        self.assertEqual(ws.List(), self.fake.sensors)
+        self.assertEqual(ws.List(), self.fake.sensors)
+        self.assertEqual(self.fake.Count(Packet.CMD_GET_SENSOR_LIST), 1)
+
+    def test_delete_does_not_wait_for_prewarm(self):
+        self.fake = FakeDongle(["AAAA%04d" % i for i in range(5)])
+        self.addCleanup(self.fake.Close)
+        self.fake.list_gate.clear()
+        ws = gateway.Open(self.fake.path, lambda ws, e: None)
+        self.addCleanup(ws.Stop)
+
+        start = time.monotonic()
+        ws.Delete("AAAA0001")
+        self.assertLess(time.monotonic() - start, 0.3)
+
+        self.fake.list_gate.set()
+        ws.PrewarmThread.join(5)
+        self.assertFalse(ws.PrewarmThread.is_alive())
+        self.assertNotIn("AAAA0001", ws.List())
+
+    def test_list_started_before_delete_not_cached(self):
+        ws = self.open(prewarm=False)
+        self.fake.list_gate.clear()
+        result = []
+        t = threading.Thread(target=lambda: result.append(ws.List()))
+        t.start()
+        self.assertTrue(self.wait_for(lambda: self.fake.Count(Packet.CMD_GET_SENSOR_LIST)))
+        # Unknown to the dongle, so the list in flight is still complete
+        ws.Delete("BBBB0001")
+        self.fake.list_gate.set()
+        t.join()
+        self.assertEqual(len(result[0]), 5)
+
+        # The fetch finished after the delete, so the list is fetched again
+        sent = self.fake.Count(Packet.CMD_GET_SENSOR_LIST)
+        self.assertEqual(len(ws.List()), 5)
+        self.assertGreater(self.fake.Count(Packet.CMD_GET_SENSOR_LIST), sent)
+
+    def test_list_slow_first_report(self):
+        ws = self.open(prewarm=False)
+        # Reports follow each other within milliseconds; the first one
+        # comes much later, and must not be mistaken for a lost request.
+        # Until then it is expected within a command RTT, which takes a
+        # few resends to learn otherwise.
+        self.fake.list_delay = 0.12
+        for _ in range(3):
+            self.assertEqual(len(ws.List(refresh=True)), 5)
+        sent = self.fake.Count(Packet.CMD_GET_SENSOR_LIST)
+        for _ in range(5):
+            self.assertEqual(len(ws.List(refresh=True)), 5)
+        self.assertEqual(self.fake.Count(Packet.CMD_GET_SENSOR_LIST) - sent, 5)
+
+    def test_list_resend_does_not_leak(self):
+        ws = self.open(prewarm=False)
+        for _ in range(5):
+            ws.List(refresh=True)
+        self.fake.list_delay = 0.3
+        self.assertEqual(len(ws.List(refresh=True)), 5)
+        self.assertGreater(self.fake.Count(Packet.CMD_GET_SENSOR_LIST), 6)
+
+        # Bursts answering the resends must not come back after a delete
+        self.fake.list_delay = 0.0
+        ws.Delete("AAAA0000")
+        self.assertEqual(ws.List(refresh=True), ["AAAA%04d" % i for i in range(1, 5)])
+
+    def test_list_count_mismatch(self):
+        # The dongle counts a sensor it never reports. A fresh dongle has
+        # no sensor list samples yet; the retries must still fail fast.
+        ws = self.open(prewarm=False)
+        self.fake.count = 6
+        start = time.monotonic()
+        self.assertEqual(len(ws.List()), 5)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.fake.Count(Packet.CMD_GET_SENSOR_LIST), 4)
+
+    def test_retry_lost_response(self):
+        ws = self.open(prewarm=False)
+        self.fake.drop[Packet.CMD_GET_SENSOR_COUNT] = 1
+        self.assertEqual(len(ws.List()), 5)
+        self.assertEqual(self.fake.Count(Packet.CMD_GET_SENSOR_COUNT), 2)
+
+    def test_failed_send_removes_handler(self):
+        ws = self.open(prewarm=False)
+        send = ws._SendPacket
+
+        def fail(pkt):
+            raise OSError("unplugged")
+
+        ws._SendPacket = fail
+        for _ in range(3):
+            self.assertRaises(OSError, ws._GetMac)
+        self.assertNotIn(Packet.CMD_GET_MAC + 1, ws._Dongle__handlers)
+
+        ws._SendPacket = send
+        self.assertEqual(ws._GetMac(), "DONGLE01")
+
+    def wait_for(self, predicate):
+        deadline = time.time() + 2
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.01)
+        return predicate()
+
+    def test_multiple_handlers(self):
+        ws = self.open(prewarm=False)
+        first, second = [], []
+        ws.AddHandler(Packet.NOTIFY_SENSOR_ALARM, first.append)
+        ws.AddHandler(Packet.NOTIFY_SENSOR_ALARM, second.append)
+
+        self.fake.Alarm("AAAA0001", int(time.time() * 1000))
+        self.assertTrue(self.wait_for(lambda: first and second and self.events))
+        self.assertIs(first[0], second[0])
+
+        self.assertTrue(ws.RemoveHandler(Packet.NOTIFY_SENSOR_ALARM, first.append))
+        self.fake.Alarm("AAAA0002", int(time.time() * 1000))
+        self.assertTrue(self.wait_for(lambda: len(second) == 2 and len(self.events) == 2))
+        self.assertEqual(len(first), 1)
+        self.assertFalse(ws.RemoveHandler(Packet.NOTIFY_SENSOR_ALARM, first.append))
+
+    def test_failing_handler(self):
+        ws = self.open(prewarm=False)
+        handled = []
+
+        def fail(pkt):
+            raise ValueError("broken handler")
+
+        ws.AddHandler(Packet.NOTIFY_SENSOR_ALARM, fail)
+        ws.AddHandler(Packet.NOTIFY_SENSOR_ALARM, handled.append)
+        with self.assertLogs("wyzesense.gateway", "ERROR") as logs:
+            self.fake.Alarm("AAAA0001", int(time.time() * 1000))
+            self.assertTrue(self.wait_for(lambda: handled and self.events))
+        self.assertIn("broken handler", "\n".join(logs.output))
+
+        # The reader thread still delivers responses
+        self.assertEqual(ws._GetMac(), "DONGLE01")
+
+    def test_event(self):
+        self.open(prewarm=False)
+        self.fake.Alarm("AAAA0001", int(time.time() * 1000))
+        deadline = time.time() + 2
+        while not self.events and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.events[0].MAC, "AAAA0001")
+        self.assertEqual(self.events[0].Type, "state")
+
+
+if __name__ == '__main__':
+    unittest.main()
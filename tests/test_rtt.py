@@ -0,0 +1,73 @@
+import unittest
+
+from wyzesense.gateway import RttEstimator
+
+
+class RttEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        self.rtt = RttEstimator(2.0, 0.05, 2.0)
+
+    def test_initial(self):
+        self.assertEqual(self.rtt.Timeout(1), 2.0)
+        self.assertEqual(self.rtt.Stats(), {})
+
+    def test_first_sample(self):
+        self.rtt.Sample(1, 0.1)
+        # srtt + 4 * rttvar, rttvar starting at rtt / 2
+        self.assertAlmostEqual(self.rtt.Timeout(1), 0.3)
+        self.assertEqual(self.rtt.Stats(), {1: (0.1, 0.05, 1), None: (0.1, 0.05, 1)})
+
+    def test_falls_back_to_all_commands(self):
+        self.rtt.Sample(1, 0.1)
+        self.assertAlmostEqual(self.rtt.Timeout(2), 0.3)
+        self.rtt.Sample(2, 0.2)
+        self.assertAlmostEqual(self.rtt.Timeout(2), 0.6)
+        self.assertAlmostEqual(self.rtt.Timeout(1), 0.3)
+
+    def test_clamped(self):
+        self.rtt.Sample(1, 0.001)
+        self.assertEqual(self.rtt.Timeout(1), 0.05)
+        self.rtt.Sample(2, 5.0)
+        self.assertEqual(self.rtt.Timeout(2), 2.0)
+
+    def test_converges(self):
+        for _ in range(100):
+            self.rtt.Sample(1, 0.2)
+        srtt, rttvar, samples = self.rtt.Stats()[1]
+        self.assertAlmostEqual(srtt, 0.2)
+        self.assertLess(rttvar, 1e-6)
+        self.assertEqual(samples, 100)
+        self.assertAlmostEqual(self.rtt.Timeout(1), 0.2, places=5)
+
+    def test_variance_widens_timeout(self):
+        for i in range(100):
+            self.rtt.Sample(1, 0.1 if i % 2 else 0.3)
+        srtt, rttvar, _ = self.rtt.Stats()[1]
+        self.assertAlmostEqual(srtt, 0.2, places=1)
+        self.assertGreater(self.rtt.Timeout(1), srtt + 0.2)
+
+    def test_backoff_kept_until_sampled(self):
+        self.rtt.Sample(1, 0.01)
+        self.rtt.Backoff(1, 0.4)
+        self.assertEqual(self.rtt.Timeout(1), 0.4)
+        self.assertEqual(self.rtt.Timeout(2), 0.05)
+        self.rtt.Backoff(1, 10)
+        self.assertEqual(self.rtt.Timeout(1), 2.0)
+        self.rtt.Sample(1, 0.01)
+        self.assertEqual(self.rtt.Timeout(1), 0.05)
+
+    def test_fallback(self):
+        fallback = RttEstimator(2.0, 0.05, 2.0)
+        rtt = RttEstimator(2.0, 0.05, 2.0, fallback)
+        self.assertEqual(rtt.Timeout(1), 2.0)
+        fallback.Sample(2, 0.1)
+        self.assertAlmostEqual(rtt.Timeout(1), 0.3)
+        rtt.Backoff(1, 0.5)
+        self.assertEqual(rtt.Timeout(1), 0.5)
+        rtt.Sample(1, 0.01)
+        self.assertEqual(rtt.Timeout(1), 0.05)
+        self.assertEqual(fallback.Stats()[None][2], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,96 +1,183 @@
-"""Example of using WyzeSense USB bridge.
+"""Command line interface for the WyzeSense USB bridge.
 
-**Usage:** ::
-  sample.py [options]
+Without a command an interactive shell is started. Every other command
+runs non-interactively; with `--format jsonl` each command prints one
+JSON object per line (one per event for `monitor`). `batch` runs several
+commands, one per line, on a single open dongle session.
 
-**Options:**
+Examples:
 
-    -d, --debug     output debug log messages to stderr
-    -v, --verbose   print and log more information
-    --device PATH   USB device path [default: /dev/hidraw0]
+  python -m wyzesense --device /dev/hidraw0          # interactive shell
+  python -m wyzesense list --format jsonl
+  python -m wyzesense pair --count 2 --timeout 30
+  python -m wyzesense unpair 777A0001 777A0002
+  python -m wyzesense monitor --format jsonl --duration 3600
+  printf 'info\\nlist\\npair --count 1\\n' | python -m wyzesense batch --format jsonl
+  python -m wyzesense decode -o out.jsonl capture1.bin capture2.bin
+  python -m wyzesense daemon --socket /tmp/wyzesense.sock
+"""
+import sys
+import json
+import time
+import shlex
+import logging
+import argparse
+import threading
 
-**Examples:** ::
+from . import gateway as wyzesense
 
-  sample.py --device /dev/hidraw0   # Using WyzeSense USB bridge /dev/hidraw0
 
-"""
-from __future__ import print_function
+class CommandError(Exception):
+    pass
 
-from builtins import input
 
-import re
-import sys
-import logging
-import binascii
+class Session(object):
+    def __init__(self, device, out):
+        self.out = out
+        self.listener = None
+        self.ws = wyzesense.Open(device, self._OnEvent)
 
-from . import gateway as wyzesense
+    def _OnEvent(self, ws, e):
+        listener = self.listener
+        if listener:
+            listener(e)
 
+    def Emit(self, args, text, obj):
+        if args.format == 'jsonl':
+            self.out.write(json.dumps(obj, sort_keys=True))
+        else:
+            self.out.write(text)
+        self.out.write("\n")
+        self.out.flush()
 
-def on_event(ws, e):
-    s = "[%s][%s]" % (e.Timestamp.strftime("%Y-%m-%d %H:%M:%S"), e.MAC)
-    if e.Type == 'state':
-        s += "StateEvent: sensor_type=%s, state=%s, battery=%d, signal=%d" % e.Data
-    else:
-        s += "RawEvent: type=%s, data=%r" % (e.Type, e.Data)
-    print(s)
+    def Close(self):
+        self.ws.Stop()
 
 
-def main(args):
-    if args['--debug']:
-        loglevel = logging.DEBUG - (1 if args['--verbose'] else 0)
-        logging.getLogger("wyzesense").setLevel(loglevel)
-        logging.getLogger().setLevel(loglevel)
+def List(session, args):
+    result = session.ws.List()
+    logging.debug("%d sensor paired:", len(result))
+    text = "%d sensor paired:" % len(result)
+    for mac in result:
+        text += "\n\tSensor: %s" % mac
+    session.Emit(args, text, {'command': 'list', 'sensors': result})
+
+
+def Info(session, args):
+    ws = session.ws
+    enr = ws.ENR.hex()
+    text = "Gateway info:\n\tMAC:%s\n\tVER:%s\n\tENR:%s" % (ws.MAC, ws.Version, enr)
+    session.Emit(args, text, {'command': 'info', 'mac': ws.MAC, 'version': ws.Version, 'enr': enr})
+
+
+def Pair(session, args):
+    sensors = []
+    lines = []
+    while len(sensors) < args.count:
+        result = session.ws.Scan(args.timeout)
+        if not result:
+            logging.debug("No sensor found!")
+            break
+
+        logging.debug("Sensor found: mac=%s, type=%d, version=%d", *result)
+        lines.append("Sensor found: mac=%s, type=%d, version=%d" % result)
+        sensors.append({'mac': result[0], 'type': result[1], 'version': result[2]})
+
+    if len(sensors) < args.count:
+        lines.append("No sensor found!" if not sensors else "Only %d sensor found!" % len(sensors))
+    session.Emit(args, "\n".join(lines), {'command': 'pair', 'sensors': sensors})
+
+
+def Unpair(session, args):
+    invalid = [mac for mac in args.mac if len(mac) != 8]
+    if invalid:
+        raise CommandError("Invalid mac address, must be 8 characters: %s" % ", ".join(invalid))
+
+    removed = []
+    lines = []
+    for mac in args.mac:
+        logging.debug("Un-pairing sensor %s:", mac)
+        session.ws.Delete(mac)
+        logging.debug("Sensor %s removed", mac)
+        lines.append("Sensor %s removed" % mac)
+        removed.append(mac)
+    session.Emit(args, "\n".join(lines), {'command': 'unpair', 'removed': removed})
 
-    device = args['--device']
-    print("Openning wyzesense gateway [%r]" % device)
+
+def Monitor(session, args):
+    done = threading.Event()
+    ctx = wyzesense.Dongle.CmdContext(count=0)
+
+    def on_event(e):
+        session.Emit(args, str(e), e.AsDict())
+        ctx.count += 1
+        if args.count and ctx.count >= args.count:
+            done.set()
+
+    session.listener = on_event
     try:
-        ws = wyzesense.Open(device, on_event)
-        if not ws:
-            print("Open wyzesense gateway failed")
-            return 1
-        print("Gateway info:")
-        print("\tMAC:%s" % ws.MAC)
-        print("\tVER:%s" % ws.Version)
-        print("\tENR:%s" % binascii.hexlify(ws.ENR))
-    except IOError:
-        print("No device found on path %r" % device)
-        return 2
+        # Waiting in short slices keeps Ctrl-C responsive
+        deadline = time.time() + args.duration if args.duration else None
+        while not done.wait(0.5):
+            if deadline and time.time() >= deadline:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.listener = None
+
 
-    def List(unused_args):
-        result = ws.List()
-        print("%d sensor paired:" % len(result))
-        logging.debug("%d sensor paired:", len(result))
-        for mac in result:
-            print("\tSensor: %s" % mac)
-            logging.debug("\tSensor: %s", mac)
-
-    def Pair(unused_args):
-        result = ws.Scan()
-        if result:
-            print("Sensor found: mac=%s, type=%d, version=%d" % result)
-            logging.debug("Sensor found: mac=%s, type=%d, version=%d", *result)
+def Batch(session, args):
+    parser = _CommandParser(batch=True)
+    ok = True
+    for line in args.script:
+        argv = shlex.split(line, comments=True)
+        if not argv:
+            continue
+
+        try:
+            cmd_args = parser.parse_args(argv)
+        except CommandError as e:
+            cmd_args = argparse.Namespace(format=args.format)
+            _Fail(session, cmd_args, argv[0], e)
+            ok = False
         else:
-            print("No sensor found!")
-            logging.debug("No sensor found!")
+            if cmd_args.format is None:
+                cmd_args.format = args.format
+            ok = _Run(session, cmd_args, argv[0]) and ok
+
+        if not ok and not args.keep_going:
+            break
+
+    if args.script is not sys.stdin:
+        args.script.close()
+    if not ok:
+        raise CommandError("batch failed")
+
 
-    def Unpair(mac_list):
+def Shell(session, args):
+    ws = session.ws
+    session.listener = lambda e: print(e)
+
+    text_args = argparse.Namespace(format='text', count=1, timeout=60)
+    print("Gateway info:")
+    print("\tMAC:%s" % ws.MAC)
+    print("\tVER:%s" % ws.Version)
+    print("\tENR:%s" % ws.ENR.hex())
+
+    def DoUnpair(mac_list):
         for mac in mac_list:
             if len(mac) != 8:
-                print("Invalid mac address, must be 8 characters: %s", mac)
-                logging.debug("Invalid mac address, must be 8 characters: %s", mac)
+                print("Invalid mac address, must be 8 characters: %s" % mac)
                 continue
-
             print("Un-pairing sensor %s:" % mac)
-            logging.debug("Un-pairing sensor %s:", mac)
-            ws.Delete(mac)
-            print("Sensor %s removed" % mac)
-            logging.debug("Sensor %s removed", mac)
+            Unpair(session, argparse.Namespace(format='text', mac=[mac]))
 
     def HandleCmd():
         cmd_handlers = {
-            'L': ('L to list', List),
-            'P': ('P to pair', Pair),
-            'U': ('U to unpair', Unpair),
+            'L': ('L to list', lambda unused_args: List(session, text_args)),
+            'P': ('P to pair', lambda unused_args: Pair(session, text_args)),
+            'U': ('U to unpair', DoUnpair),
             'X': ('X to exit', None),
         }
 
@@ -116,19 +203,174 @@ def main(args):
         while HandleCmd():
             pass
     finally:
-        ws.Stop()
+        session.listener = None
+
+
+def Decode(args):
+    from . import capture
 
+    loglevel = logging.getLogger("wyzesense").getEffectiveLevel() if args.debug else logging.CRITICAL
+    encoder, writer = capture.FORMATS[args.format]
+    records = capture.DecodeFiles(args.capture, args.workers, args.chunk_size, loglevel, encoder)
+
+    if args.output:
+        with open(args.output, "w") as out:
+            count = writer(records, out)
+    else:
+        count = writer(records, sys.stdout)
+    logging.debug("%d frames decoded", count)
     return 0
 
 
-if __name__ == '__main__':
-    logging.basicConfig(format='%(levelname)s %(asctime)s %(message)s')
+def Daemon(args):
+    import signal
+    from . import daemon
 
+    server = daemon.Server(args.socket)
     try:
-        from docopt import docopt
-    except ImportError:
-        sys.exit("the 'docopt' module is needed to execute this program")
+        # Subscribers filter server side, so event logs cost nothing unless asked for
+        ws = wyzesense.Open(args.device, server.OnEvent, forward_event_log=True)
+    except (IOError, OSError):
+        print("No device found on path %r" % args.device, file=sys.stderr)
+        return 2
 
-    # remove restructured text formatting before input to docopt
-    usage = re.sub(r'(?<=\n)\*\*(\w+:)\*\*.*\n', r'\1', __doc__)
-    sys.exit(main(docopt(usage)))
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.Stop())
+    try:
+        server.Serve(ws)
+    except KeyboardInterrupt:
+        pass
+    except daemon.DaemonError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    finally:
+        server.Stop()
+        ws.Stop()
+    return 0
+
+
+def _Fail(session, args, command, e):
+    logging.debug("Command %s failed: %r", command, e)
+    if args.format == 'jsonl':
+        session.Emit(args, None, {'command': command, 'error': str(e) or e.__class__.__name__})
+    else:
+        print("%s: %s" % (command, str(e) or e.__class__.__name__), file=sys.stderr)
+
+
+def _Run(session, args, command):
+    try:
+        args.handler(session, args)
+    except (CommandError, TimeoutError, AssertionError, OSError) as e:
+        _Fail(session, args, command, e)
+        return False
+    return True
+
+
+class _Parser(argparse.ArgumentParser):
+    # Inside batch scripts a bad line must not exit the whole process
+    def error(self, message):
+        raise CommandError(message)
+
+
+def _AddCommands(subparsers, batch):
+    fmt = dict(choices=('text', 'jsonl'), default=None if batch else 'text',
+               help="output format (default: text)")
+
+    p = subparsers.add_parser('list', help="list paired sensors")
+    p.add_argument('--format', **fmt)
+    p.set_defaults(handler=List)
+
+    p = subparsers.add_parser('info', help="show dongle MAC, version and ENR")
+    p.add_argument('--format', **fmt)
+    p.set_defaults(handler=Info)
+
+    p = subparsers.add_parser('pair', help="scan for and pair new sensors")
+    p.add_argument('--count', type=int, default=1, help="number of sensors to pair (default: 1)")
+    p.add_argument('--timeout', type=float, default=60, help="seconds to wait for each sensor (default: 60)")
+    p.add_argument('--format', **fmt)
+    p.set_defaults(handler=Pair)
+
+    p = subparsers.add_parser('unpair', help="remove paired sensors")
+    p.add_argument('mac', nargs='+', help="8 character sensor MAC")
+    p.add_argument('--format', **fmt)
+    p.set_defaults(handler=Unpair)
+
+    p = subparsers.add_parser('monitor', help="print sensor events")
+    p.add_argument('--duration', type=float, help="stop after this many seconds")
+    p.add_argument('--count', type=int, help="stop after this many events")
+    p.add_argument('--format', **fmt)
+    p.set_defaults(handler=Monitor)
+
+
+def _CommandParser(batch=False):
+    parser = _Parser(prog="batch", add_help=False)
+    subparsers = parser.add_subparsers(dest='command', parser_class=_Parser)
+    subparsers.required = True
+    _AddCommands(subparsers, batch)
+    return parser
+
+
+def _MainParser():
+    parser = argparse.ArgumentParser(
+        prog="wyzesense", description="WyzeSense USB bridge tool",
+        epilog="Without a command an interactive shell is started.")
+    parser.add_argument('-d', '--debug', action='store_true', help="output debug log messages to stderr")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print and log more information")
+    parser.add_argument('--device', default="/dev/hidraw0", help="USB device path (default: /dev/hidraw0)")
+
+    subparsers = parser.add_subparsers(dest='command')
+    _AddCommands(subparsers, False)
+
+    p = subparsers.add_parser('batch', help="run commands read from a file, one per line, on one session")
+    p.add_argument('script', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                   help="command file (default: stdin)")
+    p.add_argument('--format', choices=('text', 'jsonl'), default='text', help="default output format")
+    p.add_argument('--keep-going', action='store_true', help="continue after a failed command")
+    p.set_defaults(handler=Batch)
+
+    p = subparsers.add_parser('decode', help="decode captured dongle traffic offline")
+    p.add_argument('capture', nargs='+', help="capture file")
+    p.add_argument('--workers', type=int, help="decoder processes (default: one per CPU)")
+    p.add_argument('--chunk-size', type=int, default=4 * 1024 * 1024,
+                   help="capture bytes per decoder job (default: 4194304)")
+    p.add_argument('--format', choices=('jsonl', 'columns'), default='jsonl', help="output format (default: jsonl)")
+    p.add_argument('-o', '--output', help="output file (default: stdout)")
+
+    p = subparsers.add_parser('daemon', help="share the dongle with other processes over a Unix socket")
+    p.add_argument('--socket', default="/tmp/wyzesense.sock", help="socket path (default: /tmp/wyzesense.sock)")
+    return parser
+
+
+def main(argv=None):
+    args = _MainParser().parse_args(argv)
+
+    if args.debug:
+        loglevel = logging.DEBUG - (1 if args.verbose else 0)
+        logging.getLogger("wyzesense").setLevel(loglevel)
+        logging.getLogger().setLevel(loglevel)
+
+    if args.command == 'decode':
+        return Decode(args)
+    if args.command == 'daemon':
+        return Daemon(args)
+
+    interactive = args.command is None
+    if interactive:
+        print("Openning wyzesense gateway [%r]" % args.device)
+    try:
+        session = Session(args.device, sys.stdout)
+    except (IOError, OSError):
+        print("No device found on path %r" % args.device, file=sys.stderr)
+        return 2
+
+    try:
+        if interactive:
+            Shell(session, args)
+            return 0
+        return 0 if _Run(session, args, args.command) else 1
+    finally:
+        session.Close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(levelname)s %(asctime)s %(message)s')
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Offline decoding of captured dongle traffic.
+
+A capture file holds the byte stream read from the dongle, i.e. the HID
+report payloads concatenated in the order `Dongle._Worker` sees them.
+Files are cut into chunks which are decoded in parallel; each chunk
+resynchronizes on the 55 AA magic exactly like `Dongle._Worker` does and
+keeps decoding past its end until the frame in flight is complete, so
+frames straddling a chunk boundary are not lost. Results are merged in
+file order and frames decoded twice around a boundary are dropped.
+"""
+import os
+import json
+import logging
+import concurrent.futures
+
+from .gateway import Packet, SensorEvent
+from .eventlog import EventLogRecord
+
+log = logging.getLogger(__name__)
+
+# Largest possible frame: 5 byte header with a 1 byte length, 2 byte checksum
+_MAX_FRAME = 0xFF + 4
+_DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Event fields are those of SensorEvent.AsDict(), so decoded archives
+# match what monitor and the daemon stream live. host_time and
+# corrected_time are only known live and are always None here.
+_EVENT_COLUMNS = ('mac', 'timestamp', 'type', 'data', 'raw_time', 'host_time', 'corrected_time')
+COLUMNS = ('file', 'offset', 'cmd', 'payload') + _EVENT_COLUMNS
+
+
+def DecodePacket(pkt):
+    """Return a dict with one entry per column (except file/offset)."""
+    record = dict.fromkeys(_EVENT_COLUMNS)
+    record['cmd'] = '%04X' % pkt.Cmd
+    if pkt.Cmd == Packet.ASYNC_ACK:
+        record['payload'] = '%04X' % pkt.Payload
+        return record
+
+    record['payload'] = pkt.Payload.hex()
+    try:
+        if pkt.Cmd == Packet.NOTIFY_SENSOR_ALARM:
+            e = SensorEvent.Parse(pkt.Payload)
+            if e:
+                record.update(e.AsDict())
+        elif pkt.Cmd == Packet.NOTIFY_EVENT_LOG:
+            r = EventLogRecord.Parse(pkt.Payload)
+            if r:
+                # Live, the dongle's own MAC is used; it is not in the frame
+                record.update(SensorEvent(None, r.Timestamp / 1000.0, "log", r).AsDict())
+    except (ValueError, OverflowError, OSError, IndexError) as e:
+        # One odd frame must not abort an archive run; keep it undecoded
+        log.debug("Failed to decode %s: %r", pkt, e)
+        record.update(dict.fromkeys(_EVENT_COLUMNS))
+    return record
+
+
+def DecodeBuffer(s, base=0, end=None):
+    """Decode frames from buffer `s`, yielding (offset, length, packet).
+
+    Offsets are relative to the buffer plus `base`. Only frames starting
+    before `end` (buffer relative) are returned.
+    """
+    if end is None:
+        end = len(s)
+
+    pos = 0
+    while pos < end:
+        start = s.find(b"\x55\xAA", pos)
+        if start == -1 or start >= end:
+            break
+
+        pkt = Packet.Parse(s[start:start + _MAX_FRAME])
+        if not pkt:
+            pos = start + 2
+            continue
+
+        yield base + start, pkt.Length, pkt
+        pos = start + pkt.Length
+
+
+def EncodeJson(record):
+    return json.dumps(record, sort_keys=True)
+
+
+def _DecodeChunk(job):
+    path, start, end, encoder = job
+    with open(path, "rb") as f:
+        f.seek(start)
+        s = f.read(end - start + _MAX_FRAME)
+
+    records = []
+    for offset, length, pkt in DecodeBuffer(s, start, end - start):
+        record = DecodePacket(pkt)
+        record['file'] = path
+        record['offset'] = offset
+        # Encoding in the worker keeps the parent from becoming the bottleneck
+        records.append((offset, offset + length, encoder(record) if encoder else record))
+    return start, records
+
+
+def _InitWorker(level):
+    # Resyncing over garbage makes Packet.Parse log every failed attempt
+    logging.getLogger("wyzesense").setLevel(level)
+
+
+def _Jobs(paths, chunk_size, encoder):
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, size, chunk_size):
+            yield path, start, min(start + chunk_size, size), encoder
+
+
+def DecodeFiles(paths, workers=None, chunk_size=_DEFAULT_CHUNK_SIZE, log_level=logging.CRITICAL, encoder=None):
+    """Decode capture files, yielding records in file order.
+
+    workers=1 decodes in-process; otherwise a process pool with `workers`
+    processes (default: one per CPU) is used. If given, `encoder` must be
+    a picklable function; it is applied to each record in the workers.
+    """
+    assert chunk_size > 0
+
+    jobs = _Jobs(paths, chunk_size, encoder)
+    if workers == 1:
+        _InitWorker(log_level)
+        results = map(_DecodeChunk, jobs)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_InitWorker, initargs=(log_level,))
+        results = executor.map(_DecodeChunk, jobs)
+
+    try:
+        last_end = 0
+        for start, records in results:
+            if start == 0:
+                last_end = 0
+            for offset, end, record in records:
+                if offset < last_end:
+                    # Already decoded by the previous chunk
+                    continue
+                last_end = end
+                yield record
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def WriteLines(lines, out):
+    count = 0
+    for line in lines:
+        out.write(line)
+        out.write("\n")
+        count += 1
+    return count
+
+
+def WriteColumns(records, out):
+    columns = dict((name, []) for name in COLUMNS)
+    count = 0
+    for record in records:
+        for name in COLUMNS:
+            columns[name].append(record[name])
+        count += 1
+    json.dump({'count': count, 'columns': columns}, out)
+    out.write("\n")
+    return count
+
+
+# Output format name: (encoder, writer)
+FORMATS = {
+    'jsonl': (EncodeJson, WriteLines),
+    'columns': (None, WriteColumns),
+}
@@ -0,0 +1,135 @@
+"""Dongle clock tracking.
+
+The dongle stamps alarms and event logs with its own millisecond clock,
+which is only set when it asks the host for the time (NOTIFY_SYNC_TIME)
+and drifts in between. DongleClock estimates the offset and drift of
+that clock against the host from sync exchanges and from the host time
+each stamped packet is received at, and maps dongle timestamps onto the
+host clock.
+
+Receive times only ever lag the true event time, so only the smallest
+(host - dongle) difference seen in each bucket of dongle time is kept.
+Drift is the median slope between all pairs of those per-bucket minima
+(Theil-Sen), which holds even when some buckets saw nothing but
+delayed deliveries, and the offset is their lower envelope once the
+drift is taken out.
+"""
+import threading
+import collections
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class DongleClock(object):
+    _BUCKET = 60.0
+    _WINDOW = 64
+    # Seconds of dongle time the samples must span before drift is refit
+    _MIN_DRIFT_SPAN = 600.0
+    _MAX_DRIFT = 500e-6
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # bucket -> (dongle time, host - dongle) with the smallest difference
+        self.__samples = collections.OrderedDict()
+        self.__drift = 0.0
+        self.__ref = None
+        self.__base = 0.0
+        self.__last = None
+        self.Syncs = 0
+
+    @property
+    def Drift(self):
+        """Host seconds gained per dongle second, minus one."""
+        return self.__drift
+
+    def Offset(self, dongle_time=None):
+        """Estimated host - dongle time (seconds) at dongle_time, None
+        until anything has been observed."""
+        with self.__lock:
+            return self._Offset(dongle_time)
+
+    def _Offset(self, dongle_time):
+        if self.__ref is None:
+            return None
+        if dongle_time is None:
+            dongle_time = self.__ref
+        return self.__base + self.__drift * (dongle_time - self.__ref)
+
+    def _Fit(self):
+        samples = list(self.__samples.values())
+        span = samples[-1][0] - samples[0][0]
+        if len(samples) > 2 and span >= self._MIN_DRIFT_SPAN:
+            # A least-squares fit is dragged off by a single bucket of
+            # late deliveries; the median slope is not.
+            slopes = [(o2 - o1) / (d2 - d1)
+                      for i, (d1, o1) in enumerate(samples)
+                      for d2, o2 in samples[i + 1:] if d2 > d1]
+            if slopes:
+                slopes.sort()
+                mid = len(slopes) // 2
+                drift = slopes[mid] if len(slopes) % 2 else (slopes[mid - 1] + slopes[mid]) / 2.0
+                self.__drift = min(max(drift, -self._MAX_DRIFT), self._MAX_DRIFT)
+
+        # Drift is a property of the oscillator, so it survives syncs; the
+        # offset is the lowest sample once the drift is taken out.
+        self.__ref = samples[-1][0]
+        self.__base = min(o - self.__drift * (d - self.__ref) for d, o in samples)
+
+    def OnSync(self, host_time):
+        """The dongle was just told host_time; its clock restarts from it."""
+        with self.__lock:
+            self.__samples.clear()
+            self.__samples[int(host_time // self._BUCKET)] = (host_time, 0.0)
+            self.Syncs += 1
+            self._Fit()
+        log.debug("Clock synced at %.3f, drift=%.1fppm", host_time, self.__drift * 1e6)
+
+    def Observe(self, dongle_time, host_time):
+        """Record that a packet stamped dongle_time was received at host_time."""
+        with self.__lock:
+            self._Observe(dongle_time, host_time)
+
+    def _Observe(self, dongle_time, host_time):
+        samples = self.__samples
+        offset = host_time - dongle_time
+        bucket = int(dongle_time // self._BUCKET)
+
+        current = samples.get(bucket)
+        if current is not None:
+            if offset >= current[1]:
+                return
+            samples[bucket] = (dongle_time, offset)
+        else:
+            out_of_order = samples and bucket < next(reversed(samples))
+            samples[bucket] = (dongle_time, offset)
+            if out_of_order:
+                # Stamps are not guaranteed to arrive in order
+                self.__samples = samples = collections.OrderedDict(sorted(samples.items()))
+            while len(samples) > self._WINDOW:
+                samples.popitem(last=False)
+        self._Fit()
+
+    def Correct(self, dongle_time, host_time):
+        """Observe a stamped packet and return its time on the host clock.
+
+        Results never exceed host_time and never go backwards between
+        calls, so each dongle's corrected stream is already sorted.
+        """
+        with self.__lock:
+            self._Observe(dongle_time, host_time)
+            corrected = min(dongle_time + self._Offset(dongle_time), host_time)
+            if self.__last is not None and corrected < self.__last:
+                corrected = self.__last
+            self.__last = corrected
+        return corrected
+
+
+def MergeEvents(*streams):
+    """Merge per-dongle event streams into one ordered by CorrectedTime.
+
+    Each stream must already be ordered, which holds for events in the
+    order a Dongle delivers them.
+    """
+    import heapq
+    return heapq.merge(*streams, key=lambda e: e.CorrectedTime)
@@ -0,0 +1,468 @@
+"""Share one dongle between many processes over a Unix domain socket.
+
+Every frame on the socket is a 4 byte big-endian length followed by a
+UTF-8 encoded JSON object.
+
+Requests carry a client chosen id, and may be pipelined on a single
+connection; responses can arrive out of order:
+
+    {"id": 1, "op": "list", "args": {}}
+    {"id": 1, "result": ["777A0001"]}
+    {"id": 2, "error": "TimeoutError: _DoCommand"}
+
+Operations: info, list, scan (timeout), delete (mac), event_log (start,
+end, log_type, limit), subscribe (mac, type; each a value or a list)
+and unsubscribe (subscription). Events matching a subscription's filter are pushed as:
+
+    {"subscription": 1, "event": {"mac": ..., "type": ..., ...}}
+"""
+import os
+import json
+import queue
+import socket
+import struct
+import threading
+import concurrent.futures
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/wyzesense.sock"
+
+_MAX_FRAME = 1024 * 1024
+_QUEUE_SIZE = 1024
+_WORKERS = 8
+# Operations that change the dongle's state run one at a time on a
+# thread of their own, so however many queue up, short requests are
+# still answered by the worker pool.
+_SERIAL_OPS = frozenset(['scan', 'delete'])
+# Seconds a client waits for any reply; scans add their own timeout on top
+_CALL_TIMEOUT = 30
+
+
+class DaemonError(Exception):
+    pass
+
+
+def _RecvExact(sock, size):
+    buf = b""
+    while len(buf) < size:
+        s = sock.recv(size - len(buf))
+        if not s:
+            return None
+        buf += s
+    return buf
+
+
+def RecvFrame(sock):
+    header = _RecvExact(sock, 4)
+    if header is None:
+        return None
+
+    size, = struct.unpack(">L", header)
+    if size > _MAX_FRAME:
+        raise DaemonError("Frame too large: %d" % size)
+
+    s = _RecvExact(sock, size)
+    if s is None:
+        return None
+    return json.loads(s.decode('utf-8'))
+
+
+def EncodeFrame(obj):
+    s = json.dumps(obj).encode('utf-8')
+    return struct.pack(">L", len(s)) + s
+
+
+def _FilterSet(value):
+    # A single MAC or type is as good as a list of one
+    if not value:
+        return None
+    if isinstance(value, str):
+        return frozenset([value])
+    return frozenset(value)
+
+
+class _Subscription(object):
+    def __init__(self, sid, macs, types):
+        self.id = sid
+        self.macs = _FilterSet(macs)
+        self.types = _FilterSet(types)
+
+    def Match(self, e):
+        if self.macs is not None and e.MAC not in self.macs:
+            return False
+        if self.types is not None and e.Type not in self.types:
+            return False
+        return True
+
+
+class _Connection(object):
+    def __init__(self, server, sock):
+        self.__server = server
+        self.__sock = sock
+        # Outbound frames are queued so a slow client never stalls the
+        # dongle reader thread that fans events out.
+        self.__queue = queue.Queue(_QUEUE_SIZE)
+        self.__subscriptions = {}
+        self.__next_sid = 1
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.Dropped = 0
+
+        threading.Thread(target=self._Reader, daemon=True).start()
+        threading.Thread(target=self._Writer, daemon=True).start()
+
+    def Send(self, obj):
+        try:
+            self.__queue.put_nowait(EncodeFrame(obj))
+            return True
+        except queue.Full:
+            self.Dropped += 1
+            return False
+
+    def OnEvent(self, e, data):
+        # Sending under the lock orders events after the subscribe reply
+        with self.__lock:
+            for sub in self.__subscriptions.values():
+                if sub.Match(e) and not self.Send({'subscription': sub.id, 'event': data}):
+                    log.warning("Client queue full, event dropped")
+
+    def Subscribe(self, rid, mac=None, type=None):
+        """Add a subscription and queue the reply to request rid, before
+        any event for it can be queued."""
+        with self.__lock:
+            sid = self.__next_sid
+            self.__next_sid += 1
+            self.__subscriptions[sid] = _Subscription(sid, mac, type)
+            self.Send({'id': rid, 'result': sid})
+
+    def Unsubscribe(self, subscription):
+        with self.__lock:
+            return self.__subscriptions.pop(subscription, None) is not None
+
+    def Close(self):
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__subscriptions.clear()
+        self.__server._Remove(self)
+        self.__queue.put(None)
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__sock.close()
+
+    def _Writer(self):
+        while True:
+            frame = self.__queue.get()
+            if frame is None:
+                break
+            try:
+                self.__sock.sendall(frame)
+            except OSError:
+                break
+        self.Close()
+
+    def _Reader(self):
+        try:
+            while True:
+                req = RecvFrame(self.__sock)
+                if req is None:
+                    break
+                # Requests run concurrently so a long scan does not hold up
+                # the rest of the connection.
+                self.__server._Submit(req, self._Handle)
+        except (OSError, ValueError, DaemonError, RuntimeError) as e:
+            log.debug("Client connection error: %r", e)
+        self.Close()
+
+    def _Handle(self, req):
+        rid = req.get('id') if isinstance(req, dict) else None
+        try:
+            op, args = req['op'], req.get('args') or {}
+            if op == 'subscribe':
+                self.Subscribe(rid, args.get('mac'), args.get('type'))
+                return
+            result = self.__server._Dispatch(self, op, args)
+        except Exception as e:
+            log.debug("Request %r failed: %r", req, e)
+            self.Send({'id': rid, 'error': "%s: %s" % (e.__class__.__name__, e)})
+        else:
+            self.Send({'id': rid, 'result': result})
+
+
+class Server(object):
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__connections = set()
+        self.__dongle = None
+        self.__sock = None
+        self.__exit_event = threading.Event()
+        self.__executor = concurrent.futures.ThreadPoolExecutor(_WORKERS, "wyzesense-daemon")
+        # Dongle commands are not re-entrant for the same command id
+        self.__cmd_executor = concurrent.futures.ThreadPoolExecutor(1, "wyzesense-daemon-cmd")
+
+    def OnEvent(self, ws, e):
+        """Event handler to pass to wyzesense.Open()."""
+        with self.__lock:
+            connections = list(self.__connections)
+        if not connections:
+            return
+
+        data = e.AsDict()
+        for conn in connections:
+            conn.OnEvent(e, data)
+
+    def _Submit(self, req, handler):
+        op = req.get('op') if isinstance(req, dict) else None
+        executor = self.__cmd_executor if op in _SERIAL_OPS else self.__executor
+        executor.submit(handler, req)
+
+    def _Remove(self, conn):
+        with self.__lock:
+            self.__connections.discard(conn)
+
+    def _Dispatch(self, conn, op, args):
+        ws = self.__dongle
+        if op == 'info':
+            return {'mac': ws.MAC, 'version': ws.Version, 'enr': ws.ENR.hex()}
+        elif op == 'list':
+            # Served from the dongle's sensor cache, which has its own lock
+            return ws.List()
+        elif op == 'unsubscribe':
+            return conn.Unsubscribe(args['subscription'])
+        elif op == 'event_log':
+            records = ws.EventLog.Query(args.get('start'), args.get('end'), args.get('log_type'), args.get('limit'))
+            return [{'timestamp': r.Timestamp, 'log_type': r.Type, 'data': r.Data.hex()}
+                    for r in records]
+
+        elif op == 'scan':
+            return ws.Scan(args.get('timeout', 60))
+        elif op == 'delete':
+            ws.Delete(args['mac'])
+            return args['mac']
+        raise DaemonError("Unknown operation: %s" % op)
+
+    def _Bind(self):
+        if os.path.exists(self.__path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.__path)
+            except OSError:
+                log.debug("Removing stale socket %s", self.__path)
+                os.unlink(self.__path)
+            else:
+                raise DaemonError("Socket %s is in use" % self.__path)
+            finally:
+                probe.close()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.__path)
+        sock.listen(16)
+        return sock
+
+    def Serve(self, dongle):
+        """Accept clients until Stop() is called."""
+        self.__dongle = dongle
+        sock = self._Bind()
+        with self.__lock:
+            self.__sock = sock
+        log.debug("Listening on %s", self.__path)
+        try:
+            while not self.__exit_event.is_set():
+                try:
+                    s, _ = sock.accept()
+                except OSError:
+                    break
+                with self.__lock:
+                    self.__connections.add(_Connection(self, s))
+        finally:
+            self.Stop()
+
+    def Stop(self):
+        self.__exit_event.set()
+        with self.__lock:
+            sock, self.__sock = self.__sock, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+            try:
+                os.unlink(self.__path)
+            except OSError:
+                pass
+
+        with self.__lock:
+            connections = list(self.__connections)
+        for conn in connections:
+            conn.Close()
+        self.__executor.shutdown(wait=False)
+        self.__cmd_executor.shutdown(wait=False)
+
+
+class Client(object):
+    """Multiplexed connection to a daemon.
+
+    Use Connect() to share one connection per socket path within a
+    process instead of creating clients directly.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.__path = path
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.connect(path)
+        self.__lock = threading.Lock()
+        self.__send_lock = threading.Lock()
+        self.__next_id = 1
+        self.__pending = {}
+        self.__callbacks = {}
+        self.__refs = 0
+        self.__closed = False
+        self.__thread = threading.Thread(target=self._Reader, daemon=True)
+        self.__thread.start()
+
+    @property
+    def Closed(self):
+        return self.__closed
+
+    def _Reader(self):
+        try:
+            while True:
+                msg = RecvFrame(self.__sock)
+                if msg is None:
+                    break
+
+                if 'subscription' in msg:
+                    callback = self.__callbacks.get(msg['subscription'])
+                    if callback:
+                        self._RunCallback(callback, msg['event'])
+                    continue
+
+                with self.__lock:
+                    waiter = self.__pending.pop(msg.get('id'), None)
+                if waiter:
+                    if waiter[2] and 'result' in msg:
+                        # Runs before any later frame is read
+                        self._RunCallback(waiter[2], msg['result'])
+                    waiter[1] = msg
+                    waiter[0].set()
+        except Exception as e:
+            log.debug("Daemon connection error: %r", e)
+        finally:
+            # Without this, calls would hang until they time out and
+            # Connect() would keep handing out this client.
+            with self.__lock:
+                self.__closed = True
+                pending = list(self.__pending.values())
+                self.__pending.clear()
+            for waiter in pending:
+                waiter[0].set()
+
+    def _RunCallback(self, callback, arg):
+        try:
+            callback(arg)
+        except Exception:
+            log.exception("Daemon client callback failed")
+
+    def Call(self, op, args=None, timeout=_CALL_TIMEOUT, on_reply=None):
+        """Run op on the daemon and return its result.
+
+        on_reply(result) is called on the reader thread as soon as a
+        successful reply arrives, before any frame after it is handled.
+        timeout=None waits forever.
+        """
+        with self.__lock:
+            if self.__closed:
+                raise DaemonError("Connection closed")
+            rid = self.__next_id
+            self.__next_id += 1
+            waiter = [threading.Event(), None, on_reply]
+            self.__pending[rid] = waiter
+
+        with self.__send_lock:
+            self.__sock.sendall(EncodeFrame({'id': rid, 'op': op, 'args': args or {}}))
+
+        if not waiter[0].wait(timeout):
+            with self.__lock:
+                self.__pending.pop(rid, None)
+            raise TimeoutError("Call(%s)" % op)
+
+        resp = waiter[1]
+        if resp is None:
+            raise DaemonError("Connection closed")
+        if 'error' in resp:
+            raise DaemonError(resp['error'])
+        return resp['result']
+
+    def Info(self):
+        return self.Call('info')
+
+    def List(self):
+        return self.Call('list')
+
+    def Scan(self, timeout=60):
+        result = self.Call('scan', {'timeout': timeout}, timeout + _CALL_TIMEOUT)
+        return tuple(result) if result else None
+
+    def Delete(self, mac):
+        self.Call('delete', {'mac': mac})
+
+    def EventLog(self, start=None, end=None, log_type=None, limit=None):
+        return self.Call('event_log', {'start': start, 'end': end, 'log_type': log_type, 'limit': limit})
+
+    def Subscribe(self, callback, mac=None, type=None):
+        """Call callback(event_dict) for events matching the filter.
+
+        mac and type may each be a single value or a list of them.
+        Callbacks run on the client reader thread and must not block.
+        """
+        def on_reply(sid):
+            # Events for sid may be the very next frames
+            self.__callbacks[sid] = callback
+        return self.Call('subscribe', {'mac': mac, 'type': type}, on_reply=on_reply)
+
+    def Unsubscribe(self, sid):
+        self.__callbacks.pop(sid, None)
+        return self.Call('unsubscribe', {'subscription': sid})
+
+    def Close(self):
+        with _pool_lock:
+            self.__refs -= 1
+            if self.__refs > 0:
+                return
+            if _pool.get(self.__path) is self:
+                del _pool[self.__path]
+
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.__sock.close()
+        self.__thread.join()
+
+    def _Acquire(self):
+        self.__refs += 1
+        return self
+
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def Connect(path=DEFAULT_SOCKET):
+    """Return a pooled, reference counted Client for path.
+
+    Each Connect() must be paired with Client.Close().
+    """
+    with _pool_lock:
+        client = _pool.get(path)
+        if client is None or client.Closed:
+            client = Client(path)
+            _pool[path] = client
+        return client._Acquire()
@@ -0,0 +1,124 @@
+import struct
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class EventLogRecord(object):
+    """A single NOTIFY_EVENT_LOG record reported by the dongle.
+
+    Payload layout: 8 bytes big-endian millisecond timestamp, 1 byte
+    message length (counting the length byte itself), followed by the
+    message. The first message byte is the record type.
+    """
+    __slots__ = ('Timestamp', 'Type', 'Data', 'Truncated')
+
+    def __init__(self, timestamp, log_type, data, truncated=False):
+        self.Timestamp = timestamp
+        self.Type = log_type
+        self.Data = data
+        self.Truncated = truncated
+
+    def __str__(self):
+        return "EventLog: time=%d, type=%s, data=%s%s" % (
+            self.Timestamp,
+            "<None>" if self.Type is None else "%02X" % self.Type,
+            self.Data.hex() if self.Data else "<None>",
+            " (truncated)" if self.Truncated else "")
+
+    @classmethod
+    def Parse(cls, payload):
+        if len(payload) < 9:
+            log.debug("Invalid event log payload length: %d", len(payload))
+            return None
+
+        ts, msg_len = struct.unpack_from(">QB", payload)
+        # Trailing bytes past msg_len are not part of the message
+        msg = payload[9:8 + msg_len]
+        truncated = len(payload) < 8 + msg_len
+        if len(payload) != 8 + msg_len:
+            log.debug("Event log length mismatch, msg_len=%d, payload=%d", msg_len, len(payload))
+
+        if msg:
+            return cls(ts, msg[0], msg[1:], truncated)
+        return cls(ts, None, msg, truncated)
+
+
+class EventLogRing(object):
+    """Bounded ring buffer of EventLogRecord with simple queries.
+
+    Storage is preallocated; once full, the oldest record is overwritten.
+    Appending is O(1) and never allocates beyond the record itself.
+    """
+
+    def __init__(self, capacity=256):
+        assert capacity > 0
+        self.__lock = threading.Lock()
+        self.__records = [None] * capacity
+        self.__next = 0
+        self.__count = 0
+        self.__dropped = 0
+
+    def __len__(self):
+        return self.__count
+
+    @property
+    def Capacity(self):
+        return len(self.__records)
+
+    @property
+    def Dropped(self):
+        """Number of records overwritten since creation."""
+        return self.__dropped
+
+    def Append(self, record):
+        with self.__lock:
+            self.__records[self.__next] = record
+            self.__next = (self.__next + 1) % len(self.__records)
+            if self.__count < len(self.__records):
+                self.__count += 1
+            else:
+                self.__dropped += 1
+
+    def Clear(self):
+        with self.__lock:
+            self.__records = [None] * len(self.__records)
+            self.__next = 0
+            self.__count = 0
+
+    def _Snapshot(self):
+        with self.__lock:
+            start = (self.__next - self.__count) % len(self.__records)
+            end = start + self.__count
+            records = self.__records[start:end]
+            if end > len(self.__records):
+                records += self.__records[:end - len(self.__records)]
+        return records
+
+    def Query(self, start=None, end=None, log_type=None, limit=None):
+        """Return records oldest first, filtered by dongle timestamp
+        (milliseconds, start inclusive, end exclusive) and record type.
+
+        If limit is given, only the newest `limit` matching records are
+        returned.
+        """
+        if log_type is not None and not isinstance(log_type, (set, frozenset, list, tuple)):
+            log_type = (log_type,)
+
+        result = []
+        for r in self._Snapshot():
+            if start is not None and r.Timestamp < start:
+                continue
+            if end is not None and r.Timestamp >= end:
+                continue
+            if log_type is not None and r.Type not in log_type:
+                continue
+            result.append(r)
+
+        if limit is not None:
+            result = result[-limit:] if limit > 0 else []
+        return result
+
+    def Latest(self, count=1):
+        return self.Query(limit=count)
@@ -1,12 +1,12 @@
-from builtins import bytes
-from builtins import str
-
 import os
 import time
+import types
+import select
 import struct
 import threading
-import datetime
-import binascii
+
+from .clock import DongleClock
+from .eventlog import EventLogRecord, EventLogRing
 
 import logging
 log = logging.getLogger(__name__)
@@ -14,7 +14,7 @@ log = logging.getLogger(__name__)
 
 def bytes_to_hex(s):
     if s:
-        return binascii.hexlify(s)
+        return s.hex()
     else:
         return "<None>"
 
@@ -32,8 +32,6 @@ def MAKE_CMD(type, cmd):
 
 
 class Packet(object):
-    _CMD_TIMEOUT = 5
-
     # Sync packets:
     # Commands initiated from host side
     CMD_GET_ENR = MAKE_CMD(TYPE_SYNC, 0x02)
@@ -125,7 +123,10 @@ class Packet(object):
 
         cmd = MAKE_CMD(cmd_type, cmd_id)
         if cmd == cls.ASYNC_ACK:
-            assert len(s) >= 7
+            if len(s) < 7:
+                log.error("Invalid packet: %s", bytes_to_hex(s))
+                log.error("Invalid ACK packet length: %d", len(s))
+                return None
             s = s[:7]
             payload = MAKE_CMD(cmd_type, b2)
         elif len(s) >= b2 + 4:
@@ -216,8 +217,10 @@ class Packet(object):
         return cls(cls.CMD_SET_CH554_UPGRADE)
 
     @classmethod
-    def SyncTimeAck(cls):
-        return cls(cls.NOITFY_SYNC_TIME + 1, struct.pack(">Q", int(time.time() * 1000)))
+    def SyncTimeAck(cls, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        return cls(cls.NOITFY_SYNC_TIME + 1, struct.pack(">Q", int(timestamp * 1000)))
 
     @classmethod
     def AsyncAck(cls, cmd):
@@ -227,38 +230,73 @@ class Packet(object):
 
 class SensorEvent(object):
     def __init__(self, mac, timestamp, event_type, event_data):
+        # timestamp may be a datetime, or seconds since the epoch which is
+        # only turned into a datetime when Timestamp is first read.
         self.MAC = mac
-        self.Timestamp = timestamp
+        self._timestamp = timestamp
         self.Type = event_type
         self.Data = event_data
 
+        # Seconds since the epoch: as stamped by the dongle, when the host
+        # received the event, and the dongle stamp mapped onto the host
+        # clock (see clock.DongleClock). The latter two are only set for
+        # events delivered by a Dongle.
+        self.RawTime = timestamp if isinstance(timestamp, (int, float)) else timestamp.timestamp()
+        self.HostTime = None
+        self.CorrectedTime = None
+
+    @property
+    def Timestamp(self):
+        if isinstance(self._timestamp, (int, float)):
+            import datetime
+            self._timestamp = datetime.datetime.fromtimestamp(self._timestamp)
+        return self._timestamp
+
     def __str__(self):
         s = "[%s][%s]" % (self.Timestamp.strftime("%Y-%m-%d %H:%M:%S"), self.MAC)
         if self.Type == 'state':
             s += "StateEvent: sensor_type=%s, state=%s, battery=%d, signal=%d" % self.Data
+        elif self.Type == 'log':
+            s += "LogEvent: %s" % self.Data
         else:
             s += "RawEvent: type=%s, data=%s" % (self.Type, bytes_to_hex(self.Data))
         return s
 
+    def AsDict(self):
+        if self.Type == 'state':
+            sensor_type, state, battery, signal = self.Data
+            data = {'sensor_type': sensor_type, 'state': state, 'battery': battery, 'signal': signal}
+        elif self.Type == 'log':
+            data = {'log_type': self.Data.Type, 'data': self.Data.Data.hex()}
+        else:
+            data = self.Data.hex()
+        return {
+            'mac': self.MAC,
+            'timestamp': self.Timestamp.isoformat(),
+            'type': self.Type,
+            'data': data,
+            'raw_time': self.RawTime,
+            'host_time': self.HostTime,
+            'corrected_time': self.CorrectedTime,
+        }
 
-class Dongle(object):
-    _CMD_TIMEOUT = 2
-
-    class CmdContext(object):
-        def __init__(self, **kwargs):
-            for key in kwargs:
-                setattr(self, key, kwargs[key])
+    @classmethod
+    def Parse(cls, payload):
+        if len(payload) < 18:
+            return None
 
-    def _OnSensorAlarm(self, pkt):
-        if len(pkt.Payload) < 18:
-            log.info("Unknown alarm packet: %s", bytes_to_hex(pkt.Payload))
-            return
+        timestamp, event_type, sensor_mac = struct.unpack_from(">QB8s", payload)
+        timestamp = timestamp / 1000.0
+        try:
+            sensor_mac = sensor_mac.decode('ascii')
+        except UnicodeDecodeError:
+            return None
 
-        timestamp, event_type, sensor_mac = struct.unpack_from(">QB8s", pkt.Payload)
-        timestamp = datetime.datetime.fromtimestamp(timestamp / 1000.0)
-        sensor_mac = sensor_mac.decode('ascii')
-        alarm_data = pkt.Payload[17:]
-        if event_type == 0xA2:
+        alarm_data = payload[17:]
+        if len(alarm_data) < 9:
+            # Too short for any known layout, hand it on undecoded
+            e = cls(sensor_mac, timestamp, "raw_%02X" % event_type, alarm_data)
+        elif event_type == 0xA2:
             if alarm_data[0] == 0x01:
                 sensor_type = "switch"
                 sensor_state = "open" if alarm_data[5] == 1 else "close"
@@ -271,55 +309,197 @@ class Dongle(object):
             else:
                 sensor_type = "unknown"
                 sensor_state = "unknown"
-            e = SensorEvent(sensor_mac, timestamp, "state", (sensor_type, sensor_state, alarm_data[2], alarm_data[8]))
-        elif event_type == 0xE8:
-            if alarm_data[0] == 0x03:
-                # alarm_data[7] might be humidity in some form, but as an integer
-                # is reporting way to high to actually be humidity.
-                sensor_type = "leak:temperature"
-                sensor_state = "%d.%d" % (alarm_data[5], alarm_data[6])
-            e = SensorEvent(sensor_mac, timestamp, "state", (sensor_type, sensor_state, alarm_data[2], alarm_data[8]))
+            e = cls(sensor_mac, timestamp, "state", (sensor_type, sensor_state, alarm_data[2], alarm_data[8]))
+        elif event_type == 0xE8 and alarm_data[0] == 0x03:
+            # alarm_data[7] might be humidity in some form, but as an integer
+            # is reporting way to high to actually be humidity.
+            sensor_type = "leak:temperature"
+            sensor_state = "%d.%d" % (alarm_data[5], alarm_data[6])
+            e = cls(sensor_mac, timestamp, "state", (sensor_type, sensor_state, alarm_data[2], alarm_data[8]))
         else:
-            e = SensorEvent(sensor_mac, timestamp, "raw_%02X" % event_type, alarm_data)
+            e = cls(sensor_mac, timestamp, "raw_%02X" % event_type, alarm_data)
+
+        return e
+
+
+class RttEstimator(object):
+    """Round-trip time estimate per command, in the style of TCP's RTO.
+
+    Keeps a smoothed RTT and mean deviation per command id plus one across
+    all commands, used until a command has samples of its own. Timeouts
+    are srtt + K * rttvar, clamped to [minimum, maximum].
+
+    Resent commands give no samples, so a timeout that had to be backed
+    off is kept until the command is sampled again (as TCP does).
+
+    Without samples of its own, an estimator with a fallback defers to
+    the fallback's Timeout() instead of the initial timeout.
+    """
+    _ALPHA = 0.125
+    _BETA = 0.25
+    _K = 4
+
+    def __init__(self, initial, minimum, maximum, fallback=None):
+        self.__initial = initial
+        self.__fallback = fallback
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__lock = threading.Lock()
+        # cmd (None for all commands) -> [srtt, rttvar, samples]
+        self.__stats = {}
+        # cmd -> backed off timeout
+        self.__backoff = {}
+
+    def _Update(self, key, rtt):
+        stat = self.__stats.get(key)
+        if stat is None:
+            self.__stats[key] = [rtt, rtt / 2.0, 1]
+            return
+
+        stat[1] += self._BETA * (abs(stat[0] - rtt) - stat[1])
+        stat[0] += self._ALPHA * (rtt - stat[0])
+        stat[2] += 1
+
+    def Sample(self, cmd, rtt):
+        with self.__lock:
+            self._Update(cmd, rtt)
+            self._Update(None, rtt)
+            self.__backoff.pop(cmd, None)
+
+    def Backoff(self, cmd, timeout):
+        """Use at least timeout for cmd until its next sample."""
+        with self.__lock:
+            self.__backoff[cmd] = min(timeout, self.__maximum)
+
+    def Timeout(self, cmd):
+        with self.__lock:
+            stat = self.__stats.get(cmd) or self.__stats.get(None)
+            backoff = self.__backoff.get(cmd, 0)
+            if stat is not None:
+                timeout = stat[0] + self._K * stat[1]
+        if stat is None:
+            timeout = self.__fallback.Timeout(cmd) if self.__fallback else self.__initial
+        return min(max(timeout, backoff, self.__minimum), self.__maximum)
+
+    def Stats(self):
+        """Return {cmd: (srtt, rttvar, samples)}, cmd None being all commands."""
+        with self.__lock:
+            return dict((k, tuple(v)) for k, v in self.__stats.items())
+
+
+class Dongle(object):
+    _CMD_TIMEOUT = 2
+    _CMD_MIN_TIMEOUT = 0.05
+    _CMD_RETRIES = 3
+    _READ_BACKOFF = 0.1
+
+    # Read-only commands, safe to resend when a response is lost. Only
+    # these use adaptive timeouts; anything with side effects keeps the
+    # fixed timeout so a slow dongle is not mistaken for a failed command.
+    _IDEMPOTENT_CMDS = frozenset([
+        Packet.CMD_GET_MAC,
+        Packet.CMD_GET_KEY,
+        Packet.CMD_GET_DONGLE_VERSION,
+        Packet.CMD_GET_SENSOR_COUNT,
+        Packet.CMD_GET_SENSOR_LIST,
+    ])
+
+    class CmdContext(object):
+        def __init__(self, **kwargs):
+            for key in kwargs:
+                setattr(self, key, kwargs[key])
+
+    def _OnSensorAlarm(self, pkt):
+        host_time = time.time()
+        e = SensorEvent.Parse(pkt.Payload)
+        if not e:
+            log.info("Unknown alarm packet: %s", bytes_to_hex(pkt.Payload))
+            return
+
+        e.HostTime = host_time
+        e.CorrectedTime = self.Clock.Correct(e.RawTime, host_time)
 
         self.__on_event(self, e)
 
     def _OnSyncTime(self, pkt):
-        self._SendPacket(Packet.SyncTimeAck())
+        now = time.time()
+        self._SendPacket(Packet.SyncTimeAck(now))
+        self.Clock.OnSync(now)
 
     def _OnEventLog(self, pkt):
-        assert len(pkt.Payload) >= 9
-        ts, msg_len = struct.unpack_from(">QB", pkt.Payload)
-        # assert msg_len + 8 == len(pkt.Payload)
-        tm = datetime.datetime.fromtimestamp(ts / 1000.0)
-        msg = pkt.Payload[9:]
-        log.info("LOG: time=%s, data=%s", tm.isoformat(), bytes_to_hex(msg))
-
-    def __init__(self, device, event_handler):
+        host_time = time.time()
+        record = EventLogRecord.Parse(pkt.Payload)
+        if not record:
+            log.info("Unknown event log packet: %s", bytes_to_hex(pkt.Payload))
+            return
+
+        log.debug("LOG: %s", record)
+        self.EventLog.Append(record)
+
+        # Log records are stamped by the same clock, so they feed the
+        # estimate even when not forwarded.
+        corrected = self.Clock.Correct(record.Timestamp / 1000.0, host_time)
+        if self.__forward_event_log:
+            e = SensorEvent(self.MAC, record.Timestamp / 1000.0, "log", record)
+            e.HostTime = host_time
+            e.CorrectedTime = corrected
+            self.__on_event(self, e)
+
+    def __init__(self, device, event_handler, event_log_size=256, forward_event_log=False,
+                 defer_queries=False, prewarm=True):
         self.__lock = threading.Lock()
         self.__fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
-        self.__sensors = {}
+        # __sensors_lock only guards the cache, never dongle I/O. Fetches
+        # are serialized by __fetch_lock; one that started before the last
+        # invalidation (a bumped __sensors_gen) is not cached.
+        self.__sensors = None
+        self.__sensors_gen = 0
+        self.__sensors_lock = threading.Lock()
+        self.__fetch_lock = threading.Lock()
+        self.__prewarm_cancel = threading.Event()
+        self.__enr_lock = threading.Lock()
+        self.__version_lock = threading.Lock()
+        self.__enr = None
+        self.__version = None
         self.__exit_event = threading.Event()
         self.__thread = threading.Thread(target=self._Worker)
         self.__on_event = event_handler
-
-        self.__handlers = {
-            Packet.NOITFY_SYNC_TIME: self._OnSyncTime,
-            Packet.NOTIFY_SENSOR_ALARM: self._OnSensorAlarm,
-            Packet.NOTIFY_EVENT_LOG: self._OnEventLog,
-        }
-
-        self._Start()
+        self.__forward_event_log = forward_event_log
+        self.EventLog = EventLogRing(event_log_size)
+        self.Rtt = RttEstimator(self._CMD_TIMEOUT, self._CMD_MIN_TIMEOUT, self._CMD_TIMEOUT)
+        # The first sensor list report comes a command RTT after the
+        # request, the rest follow each other closely: estimated apart.
+        # Until sampled, both go by the RTT of the other commands.
+        self.__list_rtt = RttEstimator(self._CMD_TIMEOUT, self._CMD_MIN_TIMEOUT, self._CMD_TIMEOUT, self.Rtt)
+        self.__list_gap = RttEstimator(self._CMD_TIMEOUT, self._CMD_MIN_TIMEOUT, self._CMD_TIMEOUT, self.Rtt)
+        self.Clock = DongleClock()
+        self.MAC = None
+        self.PrewarmThread = None
+
+        # cmd -> tuple of handlers. Never mutated: writers build a new
+        # mapping under __lock and swap the reference, so the reader thread
+        # dispatches from whichever snapshot it sees without locking.
+        self.__handlers = types.MappingProxyType({
+            Packet.NOITFY_SYNC_TIME: (self._OnSyncTime,),
+            Packet.NOTIFY_SENSOR_ALARM: (self._OnSensorAlarm,),
+            Packet.NOTIFY_EVENT_LOG: (self._OnEventLog,),
+        })
+
+        self._Start(defer_queries, prewarm)
 
     def _ReadRawHID(self):
+        """Return the next report payload, b"" if none is pending or None
+        if the device failed or hung up."""
         try:
             s = os.read(self.__fd, 0x40)
-        except OSError:
+        except BlockingIOError:
             return b""
+        except (OSError, TypeError) as e:
+            log.debug("Read failed: %r", e)
+            return None
 
         if not s:
-            log.info("Nothing read")
-            return b""
+            return None
 
         s = bytes(s)
         length = s[0]
@@ -331,42 +511,87 @@ class Dongle(object):
         assert len(s) >= length + 1
         return s[1: 1 + length]
 
-    def _SetHandler(self, cmd, handler):
+    def _WaitReadable(self, timeout):
+        # Waking up as soon as data arrives, instead of polling, keeps
+        # response latency (and so the adaptive timeouts) in milliseconds.
+        try:
+            select.select([self.__fd], [], [], timeout)
+        except (OSError, ValueError, TypeError):
+            # fd closed by Stop()
+            time.sleep(timeout)
+
+    def AddHandler(self, cmd, handler):
+        """Call handler(pkt) for every packet received with command id cmd,
+        in addition to any handlers already registered for it."""
+        with self.__lock:
+            handlers = dict(self.__handlers)
+            handlers[cmd] = handlers.get(cmd, ()) + (handler,)
+            self.__handlers = types.MappingProxyType(handlers)
+
+    def RemoveHandler(self, cmd, handler):
         with self.__lock:
-            oldHandler = self.__handlers.pop(cmd, None)
-            if handler:
-                self.__handlers[cmd] = handler
-        return oldHandler
+            handlers = dict(self.__handlers)
+            current = list(handlers.get(cmd, ()))
+            if handler not in current:
+                return False
+
+            current.remove(handler)
+            if current:
+                handlers[cmd] = tuple(current)
+            else:
+                del handlers[cmd]
+            self.__handlers = types.MappingProxyType(handlers)
+        return True
 
     def _SendPacket(self, pkt):
-        log.debug("===> Sending: %s", str(pkt))
+        log.debug("===> Sending: %s", pkt)
         pkt.Send(self.__fd)
 
     def _DefaultHandler(self, pkt):
         pass
 
     def _HandlePacket(self, pkt):
-        log.debug("<=== Received: %s", str(pkt))
-        with self.__lock:
-            handler = self.__handlers.get(pkt.Cmd, self._DefaultHandler)
+        log.debug("<=== Received: %s", pkt)
+        handlers = self.__handlers.get(pkt.Cmd) or (self._DefaultHandler,)
 
         if (pkt.Cmd >> 8) == TYPE_ASYNC and pkt.Cmd != Packet.ASYNC_ACK:
             # log.info("Sending ACK packet for cmd %04X", pkt.Cmd)
             self._SendPacket(Packet.AsyncAck(pkt.Cmd))
-        handler(pkt)
+        for handler in handlers:
+            try:
+                handler(pkt)
+            except Exception:
+                # One failing handler must neither starve the others nor
+                # kill the reader thread
+                log.exception("Handler for %04X failed", pkt.Cmd)
 
     def _Worker(self):
         s = b""
+        backoff = 0
         while True:
             if self.__exit_event.isSet():
                 break
 
-            s += self._ReadRawHID()
+            data = self._ReadRawHID()
+            if data is None:
+                if self.__exit_event.is_set():
+                    # fd closed by Stop()
+                    break
+                # A hung up device polls readable forever, so select would
+                # spin; back off until reads succeed again.
+                if not backoff:
+                    log.warning("Reading from the dongle failed, backing off")
+                backoff = min(2 * backoff or self._READ_BACKOFF, self._CMD_TIMEOUT)
+                self.__exit_event.wait(backoff)
+                continue
+            backoff = 0
+
+            s += data
             # if s:
             #     log.info("Incoming buffer: %s", bytes_to_hex(s))
             start = s.find(b"\x55\xAA")
             if start == -1:
-                time.sleep(0.1)
+                self._WaitReadable(0.1)
                 continue
 
             s = s[start:]
@@ -380,25 +605,61 @@ class Dongle(object):
             s = s[pkt.Length:]
             self._HandlePacket(pkt)
 
-    def _DoCommand(self, pkt, handler, timeout=_CMD_TIMEOUT):
+    def _CmdTimeout(self, cmd):
+        if cmd in self._IDEMPOTENT_CMDS:
+            return self.Rtt.Timeout(cmd)
+        return self._CMD_TIMEOUT
+
+    def _DoCommand(self, pkt, handler, timeout=None, sample=True):
+        # Pass sample=False for a resent command: its response may answer
+        # an earlier send, so its RTT is ambiguous (Karn's algorithm).
+        if timeout is None:
+            timeout = self._CmdTimeout(pkt.Cmd)
+
         e = threading.Event()
-        oldHandler = self._SetHandler(pkt.Cmd + 1, lambda pkt: handler(pkt, e))
-        self._SendPacket(pkt)
-        result = e.wait(timeout)
-        self._SetHandler(pkt.Cmd + 1, oldHandler)
+        ctx = self.CmdContext(sent=None)
+
+        def cmd_handler(resp):
+            if ctx.sent is not None:
+                self.Rtt.Sample(pkt.Cmd, time.monotonic() - ctx.sent)
+                ctx.sent = None
+            handler(resp, e)
+
+        self.AddHandler(pkt.Cmd + 1, cmd_handler)
+        try:
+            if sample:
+                ctx.sent = time.monotonic()
+            self._SendPacket(pkt)
+            result = e.wait(timeout)
+        finally:
+            self.RemoveHandler(pkt.Cmd + 1, cmd_handler)
 
         if not result:
             raise TimeoutError("_DoCommand")
 
-    def _DoSimpleCommand(self, pkt, timeout=_CMD_TIMEOUT):
+    def _DoSimpleCommand(self, pkt, timeout=None, retries=None):
+        if retries is None:
+            retries = self._CMD_RETRIES if pkt.Cmd in self._IDEMPOTENT_CMDS else 0
+
         ctx = self.CmdContext(result=None)
 
         def cmd_handler(pkt, e):
             ctx.result = pkt
             e.set()
 
-        self._DoCommand(pkt, cmd_handler, timeout)
-        return ctx.result
+        attempt_timeout = timeout
+        for attempt in range(retries + 1):
+            try:
+                self._DoCommand(pkt, cmd_handler, attempt_timeout, sample=(attempt == 0))
+                return ctx.result
+            except TimeoutError:
+                if attempt == retries:
+                    raise
+                # Back off like TCP does, a congested dongle is still alive
+                attempt_timeout = min(2 * (attempt_timeout or self._CmdTimeout(pkt.Cmd)), self._CMD_TIMEOUT)
+                if timeout is None and pkt.Cmd in self._IDEMPOTENT_CMDS:
+                    self.Rtt.Backoff(pkt.Cmd, attempt_timeout)
+                log.debug("Command %04X timed out, retrying in %.3fs", pkt.Cmd, attempt_timeout)
 
     def _Inquiry(self):
         log.debug("Start Inquiry...")
@@ -462,61 +723,237 @@ class Dongle(object):
         result = resp.Payload[0]
         assert result == 0x01, "DisableScan failed, result=%d"
 
-    def _GetSensors(self):
+    def _GetSensorList(self, ctx):
+        # Sensors report one packet each; rather than waiting count times
+        # the worst case, give up once the gap between two reports exceeds
+        # the adaptive timeout. A lost report only costs a resend; sensors
+        # already seen are kept.
+        cmd = Packet.CMD_GET_SENSOR_LIST
+        cond = threading.Condition()
+
+        def cmd_handler(pkt):
+            if len(pkt.Payload) != 8:
+                log.info("Unexpected sensor list packet: %s", bytes_to_hex(pkt.Payload))
+                return
+            mac = pkt.Payload.decode('ascii')
+            with cond:
+                now = time.monotonic()
+                # After a resend a report may belong to either request
+                if not ctx.resent:
+                    if ctx.last is None:
+                        self.__list_rtt.Sample(cmd, now - ctx.sent)
+                    else:
+                        self.__list_gap.Sample(cmd, now - ctx.last)
+                ctx.last = now
+                ctx.reports += 1
+                if mac not in ctx.sensors:
+                    log.debug("Sensor %d/%d, MAC:%s", len(ctx.sensors) + 1, ctx.count, mac)
+                    ctx.sensors.append(mac)
+                cond.notify_all()
+
+        # One handler across attempts, so reports answering an earlier
+        # request still count.
+        self.AddHandler(cmd + 1, cmd_handler)
+        try:
+            with cond:
+                first_timeout = self.__list_rtt.Timeout(cmd)
+                backed_off = False
+                for attempt in range(self._CMD_RETRIES + 1):
+                    if attempt and ctx.cancel.is_set():
+                        break
+                    if attempt:
+                        log.debug("Sensor list incomplete (%d/%d), retrying...", len(ctx.sensors), ctx.count)
+                        if ctx.reports == attempt_reports:
+                            # Nothing came back at all; the dongle may be slow
+                            first_timeout = min(2 * first_timeout, self._CMD_TIMEOUT)
+                            backed_off = True
+                    attempt_reports = ctx.reports
+                    ctx.resent = attempt > 0
+                    ctx.last = None
+                    ctx.sent = time.monotonic()
+                    self._SendPacket(Packet.GetSensorList(ctx.count))
+
+                    while len(ctx.sensors) < ctx.count:
+                        reports = ctx.reports
+                        if ctx.last is None or ctx.resent:
+                            cond.wait(first_timeout)
+                        else:
+                            cond.wait(self.__list_gap.Timeout(cmd))
+                        if ctx.reports == reports:
+                            break
+                    if len(ctx.sensors) == ctx.count:
+                        break
+
+                if backed_off:
+                    self.__list_rtt.Backoff(cmd, first_timeout)
+
+                if ctx.resent or len(ctx.sensors) < ctx.count:
+                    # Bursts answering the other requests may still be on
+                    # their way; let them land here rather than in the next
+                    # List() after the handler is gone.
+                    while True:
+                        idle = time.monotonic() - max(ctx.sent, ctx.last or 0)
+                        if idle >= first_timeout:
+                            break
+                        cond.wait(first_timeout - idle)
+        finally:
+            self.RemoveHandler(cmd + 1, cmd_handler)
+
+    def _GetSensors(self, cancel=None):
+        """Return (sensors, complete). Retries stop early once cancel is set."""
         log.debug("Start GetSensors...")
 
         resp = self._DoSimpleCommand(Packet.GetSensorCount())
         assert len(resp.Payload) == 1
         count = resp.Payload[0]
 
-        ctx = self.CmdContext(count=count, index=0, sensors=[])
+        ctx = self.CmdContext(count=count, sensors=[], reports=0, sent=None, last=None, resent=False,
+                              cancel=cancel or threading.Event())
         if count > 0:
             log.debug("%d sensors reported, waiting for each one to report...", count)
+            self._GetSensorList(ctx)
 
-            def cmd_handler(pkt, e):
-                assert len(pkt.Payload) == 8
-                mac = pkt.Payload.decode('ascii')
-                log.debug("Sensor %d/%d, MAC:%s", ctx.index + 1, ctx.count, mac)
-
-                ctx.sensors.append(mac)
-                ctx.index += 1
-                if ctx.index == ctx.count:
-                    e.set()
-
-            self._DoCommand(Packet.GetSensorList(count), cmd_handler, timeout=self._CMD_TIMEOUT * count)
+            if not ctx.sensors:
+                raise TimeoutError("_GetSensors")
+            if len(ctx.sensors) < count:
+                log.warning("Only %d of %d sensors reported", len(ctx.sensors), count)
+                return ctx.sensors, False
         else:
             log.debug("No sensors bond yet...")
-        return ctx.sensors
+
+        return ctx.sensors, True
 
     def _FinishAuth(self):
         resp = self._DoSimpleCommand(Packet.FinishAuth())
         assert len(resp.Payload) == 0
 
-    def _Start(self):
-        self.__thread.start()
-
+    def _RunSteps(self, steps):
+        """Run {name: (func, deps)}, each step in its own thread as soon as
+        all steps it depends on are done. Raises the first failure."""
+        done = dict((name, threading.Event()) for name in steps)
+        errors = []
+
+        def run(name, func, deps):
+            try:
+                for dep in deps:
+                    done[dep].wait()
+                if not errors:
+                    func()
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                done[name].set()
+
+        threads = [threading.Thread(target=run, args=(name, func, deps)) for name, (func, deps) in steps.items()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+
+    def _Prewarm(self):
+        # A Scan or Delete cancels the prewarm: the list is about to change
+        # and the command should not queue behind it.
         try:
-            self._Inquiry()
+            self._FetchSensors(False, self.__prewarm_cancel)
+        except Exception as e:
+            if self.__prewarm_cancel.is_set():
+                log.debug("Sensor list prewarm cancelled: %r", e)
+            else:
+                log.warning("Sensor list prewarm failed: %r", e)
 
-            self.ENR = self._GetEnr([0x30303030] * 4)
+    def _Start(self, defer_queries=False, prewarm=True):
+        self.__thread.start()
+
+        def get_mac():
             self.MAC = self._GetMac()
             log.debug("Dongle MAC is [%s]", self.MAC)
 
-            self.Version = self._GetVersion()
-            log.debug("Dongle version: %s", self.Version)
+        # GetEnr, GetMAC and GetVersion only depend on Inquiry, so they
+        # are in flight at the same time.
+        steps = {
+            'inquiry': (self._Inquiry, ()),
+            'mac': (get_mac, ('inquiry',)),
+        }
+        if not defer_queries:
+            steps['enr'] = (lambda: self.ENR, ('inquiry',))
+            steps['version'] = (lambda: self.Version, ('inquiry',))
+        steps['finish_auth'] = (self._FinishAuth, tuple(name for name in steps if name != 'inquiry'))
 
-            self._FinishAuth()
+        try:
+            self._RunSteps(steps)
         except:
             self.Stop()
             raise
 
-    def List(self):
-        sensors = self._GetSensors()
+        if prewarm:
+            # Events already flow; the sensor list is filled in behind them
+            self.PrewarmThread = threading.Thread(target=self._Prewarm)
+            self.PrewarmThread.daemon = True
+            self.PrewarmThread.start()
+
+    def _CheckCanQuery(self, name):
+        # The reply would have to be delivered by the very thread waiting
+        # for it, so it could only ever time out.
+        if threading.current_thread() is self.__thread:
+            raise RuntimeError("%s is not known yet and cannot be queried from an event handler" % name)
+
+    @property
+    def ENR(self):
+        """Queried from the dongle on first access with defer_queries=True,
+        which must then not happen in an event handler."""
+        if self.__enr is None:
+            self._CheckCanQuery("ENR")
+            with self.__enr_lock:
+                if self.__enr is None:
+                    self.__enr = self._GetEnr([0x30303030] * 4)
+        return self.__enr
+
+    @property
+    def Version(self):
+        """See ENR."""
+        if self.__version is None:
+            self._CheckCanQuery("Version")
+            with self.__version_lock:
+                if self.__version is None:
+                    self.__version = self._GetVersion()
+                    log.debug("Dongle version: %s", self.__version)
+        return self.__version
+
+    def List(self, refresh=False):
+        sensors = self._FetchSensors(refresh)
         for x in sensors:
             log.debug("Sensor found: %s", x)
 
         return sensors
 
+    def _FetchSensors(self, refresh, cancel=None):
+        with self.__sensors_lock:
+            if self.__sensors is not None and not refresh:
+                return list(self.__sensors)
+
+        with self.__fetch_lock:
+            with self.__sensors_lock:
+                # Filled in by a fetch this one queued behind
+                if self.__sensors is not None and not refresh:
+                    return list(self.__sensors)
+                gen = self.__sensors_gen
+            if cancel is not None and cancel.is_set():
+                return []
+
+            sensors, complete = self._GetSensors(cancel)
+            with self.__sensors_lock:
+                if complete and gen == self.__sensors_gen:
+                    self.__sensors = list(sensors)
+        return sensors
+
+    def _InvalidateSensors(self):
+        with self.__sensors_lock:
+            self.__sensors = None
+            self.__sensors_gen += 1
+
     def Stop(self, timeout=_CMD_TIMEOUT):
         self.__exit_event.set()
         os.close(self.__fd)
@@ -526,6 +963,7 @@ class Dongle(object):
     def Scan(self, timeout=60):
         log.debug("Start Scan...")
 
+        self.__prewarm_cancel.set()
         ctx = self.CmdContext(evt=threading.Event(), result=None)
 
         def scan_handler(pkt):
@@ -533,7 +971,7 @@ class Dongle(object):
             ctx.result = (pkt.Payload[1:9].decode('ascii'), pkt.Payload[9], pkt.Payload[10])
             ctx.evt.set()
 
-        old_handler = self._SetHandler(Packet.NOTIFY_SENSOR_SCAN, scan_handler)
+        self.AddHandler(Packet.NOTIFY_SENSOR_SCAN, scan_handler)
         try:
             self._DoSimpleCommand(Packet.EnableScan())
 
@@ -547,14 +985,17 @@ class Dongle(object):
 
             self._DoSimpleCommand(Packet.DisableScan())
         finally:
-            self._SetHandler(Packet.NOTIFY_SENSOR_SCAN, old_handler)
+            self.RemoveHandler(Packet.NOTIFY_SENSOR_SCAN, scan_handler)
         if ctx.result:
             s_mac, s_type, s_ver = ctx.result
             self._DoSimpleCommand(Packet.VerifySensor(s_mac))
+            self._InvalidateSensors()
         return ctx.result
 
     def Delete(self, mac):
+        self.__prewarm_cancel.set()
         resp = self._DoSimpleCommand(Packet.DelSensor(str(mac)))
+        self._InvalidateSensors()
         log.debug("CmdDelSensor returns %s", bytes_to_hex(resp.Payload))
         assert len(resp.Payload) == 9
         ack_mac = resp.Payload[:8].decode('ascii')
@@ -564,5 +1005,5 @@ class Dongle(object):
         log.debug("CmdDelSensor: %s deleted", mac)
 
 
-def Open(device, event_handler):
-    return Dongle(device, event_handler)
+def Open(device, event_handler, **kwargs):
+    return Dongle(device, event_handler, **kwargs)